@@ -1,5 +1,6 @@
 import sys
 import os
+import multiprocessing
 from pathlib import Path
 import numpy as np
 import cv2
@@ -12,6 +13,7 @@ from Images import Images
 from TypeOneDetections import TypeOneDetections
 from PredictionGrids import PredictionGrids
 from BeginDialog import BeginDialog
+from stats import write_stats, export_overlay, get_imwrite_params
 
 
 
@@ -102,7 +104,11 @@ class Dataset(object):
         if not self.progress["prediction_grids_finished_editing"]:
             self.prediction_grids.edit()
 
-    def get_stats(self):
+    def get_stats(self, overlay_format=".png", overlay_compression=None, overlay_workers=None):
+        # overlay_format is the format of the displayable results, one of stats.overlay_compression_flags, and
+        # overlay_compression its compression setting (see stats.overlay_compression_flags), or None for the default.
+        # overlay_workers is the number of processes used to write them, defaulting to the number of cpus.
+
         # Once we're sure the user's session is complete:
         if self.progress["prediction_grids_finished_editing"]:
 
@@ -113,131 +119,58 @@ class Dataset(object):
                 initialdir=os.path.join(str(Path.home()), 'Documents'),
                 initialfile='{}_stats.csv'.format(self.uid),
                 filetypes=[("CSV file", "*.csv")])
-            # Generate a CSV with raw counts of each classification on each image,
-            #   with the percentages each classification takes up of the image,
-            #   not including empty slide,
-            #   and the number of type one lesions detected on each image.
-            with open(outfile_name, "w") as f:
-                # Write Header line
-                f.write("Image,Healthy Tissue,Type I - Caseum,Type II,Type III,Type I - Rim,Unknown/Misc,\
-                        ,Healthy Tissue,Type I - Caseum,Type II,Type III,Type I - Rim,Unknown/Misc,\
-                        ,Number of Type One Lesions\n")
-
-                # Iterate through predictions and detections
-
-                prediction_sums = []
-                last_prediction_counts = None
-                last_name = None
-                last_detection_count = None
-                for i, (prediction_grid, detections) in enumerate(
-                        zip(self.prediction_grids.after_editing, self.type_one_detections.after_editing)):
-                    sys.stdout.write("\rGenerating Stats on Image {}/{}...".format(i, len(self.imgs) - 1))
-
-                    # Get counts of each classification type, excluding empty slide
-                    prediction_counts = np.zeros((6))
-                    classification_i = 0
-                    for classification in range(7):
-                        if classification != 3:
-                            prediction_counts[classification_i] = np.sum(prediction_grid == classification)
-                            classification_i += 1
-                    if i == 0:
-                        prediction_sums = prediction_counts
-                    else:
-                        for j, count in enumerate(prediction_counts):
-                            prediction_sums[j] += count
-                    # Get total number of classifications for this image
-                    prediction_n = np.sum(prediction_counts)
-
-                    # Get percentage each classification takes up of the total classifications
-                    prediction_avgs = 100 * prediction_counts / prediction_n
-
-                    # Get the number of Type One Lesions / Type One Detection Clusters in this image
-                    detection_count = len(get_rect_clusters(detections))
-
-                    # Write
-                    full_name = self.imgs.fnames[i]
-                    # if full_name.endswith("(1)"):
-                    #     last_prediction_counts = prediction_counts
-                    #     last_name = " ".join(full_name.split(" ")[:-1])
-                    #     last_detection_count = detection_count
-                    #     continue
-                    # el
-                    if full_name.endswith(")"):
-
-                        current_name = " ".join(full_name.split(" ")[:-1])
-                        if last_prediction_counts is None:
-                            last_prediction_counts = prediction_counts
-                            last_detection_count = detection_count
-                            last_name = current_name
-                        elif last_name == current_name:
-                            for j in range(len(last_prediction_counts)):
-                                last_prediction_counts[j] += prediction_counts[j]
-                            last_detection_count += detection_count
-                            detection_count = last_detection_count
-                            prediction_counts = last_prediction_counts
-                        if i + 1 < len(self.imgs.fnames):
-                            next_name = " ".join(self.imgs.fnames[i + 1].split(" ")[:-1])
-                            if next_name == current_name:
-                                continue
-                            else:
-                                full_name = current_name
-                                prediction_counts = last_prediction_counts
-                                detection_count = last_detection_count
-                                last_prediction_counts = None
-                                last_name = None
-                                last_detection_count = None
-                        else:
-                            full_name = current_name
-
-                    f.write("{},{},,{},,{}\n".format(full_name, ",".join(map(str, list(prediction_counts))),
-                                                     ",".join(map(str, list(prediction_avgs))), detection_count))
-
-
-                detection_total = sum([len(get_rect_clusters(d)) for d in self.type_one_detections.after_editing])
-
-                total = sum(prediction_sums)
-                sum_average = [100 * p / total for p in prediction_sums]
-
-                f.write("\nsummary,{},,{},,{}\n".format(",".join(map(str, list(prediction_sums))),
-                                                        ",".join(map(str, list(sum_average))),
-                                                        detection_total))
-
-                sys.stdout.flush()
-                print("")
-
-            # Generate a displayable image of the predictions overlaid, for each image.
+
+            # Generate a displayable image of the predictions overlaid, for each image. Each image is exported by
+            # a pool of worker processes, which start while we generate the CSV below.
             resize_factor = 1 / 8
             color_key = [(255, 0, 255), (0, 0, 255), (0, 255, 0), (200, 200, 200), (0, 255, 255), (255, 0, 0),
                          (244, 66, 143)]
             alpha = 0.33
-            for i, (img, prediction_grid) in enumerate(zip(self.imgs, self.prediction_grids.after_editing)):
-                sys.stdout.write("\rGenerating Displayable Results for Image {}/{}...".format(i, len(self.imgs) - 1))
-
-                # Since our image and predictions would be slightly misalgned from each other due to rounding,
-                # We recompute the sub_h and sub_w and img resize factors to make them aligned.
-                sub_h = int(resize_factor * self.prediction_grids.sub_h)
-                sub_w = int(resize_factor * self.prediction_grids.sub_w)
-                fy = (prediction_grid.shape[0] * sub_h) / img.shape[0]
-                fx = (prediction_grid.shape[1] * sub_w) / img.shape[1]
-
-                # Then resize the image with these new factors
-                img = cv2.resize(img, (0, 0), fx=fx, fy=fy)
-
-                # Make overlay to store prediction rectangles on before overlaying on top of image
-                prediction_overlay = np.zeros_like(img)
-
-                for row_i, row in enumerate(prediction_grid):
-                    for col_i, col in enumerate(row):
-                        color = color_key[col]
-                        # draw rectangles of the resized sub_hxsub_w size on it
-                        cv2.rectangle(prediction_overlay, (col_i * sub_w, row_i * sub_h),
-                                      (col_i * sub_w + sub_w, row_i * sub_h + sub_h), color, -1)
-
-                # Add overlay to image to get resulting image
-                display_img = weighted_overlay(img, prediction_overlay, alpha)
-
-                # Write img
-                cv2.imwrite("../../Output Stats/{}_overlay_{}.png".format(self.uid, self.imgs.fnames[i]), display_img)
+            sub_h = int(resize_factor * self.prediction_grids.sub_h)
+            sub_w = int(resize_factor * self.prediction_grids.sub_w)
+            imwrite_params = get_imwrite_params(overlay_format, overlay_compression)
+            # Spawned rather than forked, since this process is running TensorFlow and background threads which a
+            # forked worker could inherit mid-operation, e.g. holding h5py's lock
+            pool = multiprocessing.get_context("spawn").Pool(overlay_workers)
+            results = [
+                pool.apply_async(export_overlay, (
+                    self.imgs.archives[i],
+                    prediction_grid,
+                    sub_h,
+                    sub_w,
+                    color_key,
+                    alpha,
+                    "../../Output Stats/{}_overlay_{}{}".format(self.uid, self.imgs.fnames[i], overlay_format),
+                    imwrite_params
+                ))
+                for i, prediction_grid in enumerate(self.prediction_grids.after_editing)
+            ]
+            pool.close()
+
+            # Generate a CSV with raw counts of each classification on each image,
+            #   with the percentages each classification takes up of the image,
+            #   not including empty slide,
+            #   and the number of type one lesions detected on each image.
+            try:
+                with open(outfile_name, "w", newline="") as f:
+                    sys.stdout.write("\rGenerating Stats...")
+
+                    # Get the number of Type One Lesions / Type One Detection Clusters in each image, once per image
+                    detection_counts = [len(get_rect_clusters(d)) for d in self.type_one_detections.after_editing]
+                    write_stats(f, self.imgs.fnames, self.prediction_grids.after_editing, detection_counts)
+
+                    sys.stdout.flush()
+                    print("")
+
+                # Wait for the displayable results, raising any worker's error
+                for i, result in enumerate(results):
+                    sys.stdout.write(
+                        "\rGenerating Displayable Results for Image {}/{}...".format(i, len(self.imgs) - 1))
+                    result.get()
+            except:
+                pool.terminate()
+                raise
+            pool.join()
 
             sys.stdout.flush()
             print("")
@@ -3,6 +3,14 @@ import numpy as np
 
 from base import *
 
+def save_archive(fpath, data):
+    #Write to a temporary file then replace the archive with it, so that any memory maps of the old archive
+    #stay valid and a reader never sees a partially written archive.
+    tmp_fpath = fpath + ".tmp"
+    with open(tmp_fpath, 'wb') as f:
+        np.save(f, data)
+    os.replace(tmp_fpath, fpath)
+
 class EditingDataset(object):
     #For use with both predictions and detections, both before and after editing.
     def __init__(self, dataset, uid, archive_dir, restart=False):
@@ -37,7 +45,7 @@ class EditingDataset(object):
         return np.load(self.archives[i])
 
     def __setitem__(self, i, data):
-        return np.save(self.archives[i], data)
+        save_archive(self.archives[i], data)
 
     def __len__(self):
         #Same as len(imgs) by definition
@@ -12,6 +12,18 @@ class ImageSubsections(object):
         self.sub_h = sub_h
         self.sub_w = sub_w
 
+        #Strided view of the image cropped to a whole number of subsections, with shape (grid_h, grid_w, sub_h, sub_w, ...),
+        #so that tiles[row_i, col_i] is the subsection at that grid position. Splitting the axes and swapping them never
+        #copies the image. This is only possible for np arrays (including memory maps), for other array-like images we
+        #fall back to slicing each subsection.
+        self.grid_h = self.img.shape[0]//self.sub_h
+        self.grid_w = self.img.shape[1]//self.sub_w
+        if isinstance(self.img, np.ndarray):
+            cropped = self.img[:self.grid_h*self.sub_h, :self.grid_w*self.sub_w]
+            self.tiles = cropped.reshape((self.grid_h, self.sub_h, self.grid_w, self.sub_w) + self.img.shape[2:]).swapaxes(1, 2)
+        else:
+            self.tiles = None
+
     def __iter__(self):
         #Loop through subsections of size sub_hxsub_w in our image.
         for row_i in range(0, self.img.shape[0]-self.sub_h, self.sub_h):
@@ -21,8 +33,12 @@ class ImageSubsections(object):
     def __getitem__(self, indices):
         #Handle indexing with lists only, since that's the only type of indexing we use with this class.
         #We return a 4d np array 
-        row_indices = indices // (self.img.shape[1]//self.sub_w)
-        col_indices = indices % (self.img.shape[1]//self.sub_w)
+        row_indices = indices // self.grid_w
+        col_indices = indices % self.grid_w
+
+        #Gather the whole batch with one fancy index into our strided view, copying each subsection exactly once.
+        if self.tiles is not None:
+            return self.tiles[row_indices, col_indices]
 
         #We scale them up from subsection resolution to match our image resolution now that we have the 2d cords.
         row_indices = row_indices * self.sub_h
@@ -31,5 +47,5 @@ class ImageSubsections(object):
         return np.array([self.img[row_i:row_i+self.sub_h, col_i:col_i+self.sub_w] for (row_i, col_i) in zip(row_indices, col_indices)])
 
     def __len__(self):
-        return (self.img.shape[0]//self.sub_h)*(self.img.shape[1]//self.sub_w)
+        return self.grid_h*self.grid_w
 
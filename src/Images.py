@@ -4,22 +4,21 @@ import numpy as np
 import os
 from pathlib import Path
 import json
-import openslide
+import multiprocessing
 from tkinter import *
 from tkinter import messagebox
 import tkfilebrowser
 import PIL
-from keras_retinanet.utils.image import read_image_bgr
 from PIL import ImageTk, Image
 PIL.Image.MAX_IMAGE_PIXELS = 2000000000
-import czifile as czf
-from openslide_python_fix import _load_image_lessthan_2_29, _load_image_morethan_2_29
 
 from convert_vsi import convert_vsi
 from LiraExceptions import InputEmptyError
 from base import *
 from ProgressBar import ProgressRoot
 from ImageResolutions import ImageResolutions
+from SlideArchive import SlideArchive
+from archiving import archive_src_img, save_editor_img
 
 def q_key_press(event=None):
     if messagebox.askquestion(
@@ -28,41 +27,9 @@ def q_key_press(event=None):
     ) == 'yes':
         sys.exit('Exiting...')
 
-def read_openslide_img(img_file):
-    """
-    Opens img_file, converts to PIL image,
-    and returns the image.
-    Args:
-                img_file : File name
-              upper_left : the (x,y) coordinates of the .svs image_ext
-    Output:
-            Returns tuple of PIL images
-    """
-    img = openslide.open_slide(img_file)
-    w_rec, h_rec = img.dimensions
-    w_rec_half = w_rec // 2
-    if (h_rec * w_rec) >= 2 ** 29:
-        openslide.lowlevel._load_image = _load_image_morethan_2_29
-    else:
-        openslide.lowlevel._load_image = _load_image_lessthan_2_29
-    if w_rec * h_rec >= 2 ** 29:
-        try:
-            region1 = img.read_region((0, 0),
-                                      0, (w_rec_half, h_rec)).convert('RGB')
-
-            region2 = img.read_region((w_rec_half,
-                                       0),
-                                      0, ((w_rec - w_rec_half), h_rec)).convert('RGB')
-            return region1, region2
-
-        except IOError:
-            region1 = img.read_region((0, 0),
-                                      0, (w_rec, h_rec)).convert('RGB')
-            return region1,
-    else:
-        region1 = img.read_region((0, 0),
-                                  0, (w_rec, h_rec)).convert('RGB')
-        return region1,
+def get_editor_img_fpath(archive_fpath):
+    # e.g. ../data/images/user_img_0.h5 -> ../data/images/user_img_0_editor.npy
+    return "{}_editor.npy".format(os.path.splitext(archive_fpath)[0])
 
 class Images(object):
     """
@@ -72,28 +39,32 @@ class Images(object):
         as other instances.
     """
 
-    def __init__(self, username, restart=False):
+    def __init__(self, username, restart=False, archive_workers=None):
+        # archive_workers is the number of processes used to archive images when restarting, defaulting to the
+        # number of cpus. Images are streamed into their archives where possible, so each worker's memory use is
+        # bounded by the largest non-slide image it has to load.
         self.vsi_img_dir = "../../Input Images/"  # where vsi image files are moved to
-        self.archive_dir = "../data/images/"  # where we will create and store the .npy archive files
+        self.archive_dir = "../data/images/"  # where we will create and store the .h5 archive files
         fname_dir = "../data/filenames/"
         self.archives = []  # where we will store list of full filepaths for each archive in our archive_dir
         self.thumbnails = []  # where smaller thumbnail image filepaths will be stored
+        self.editor_imgs = []  # where the filepaths of each image's rendition for the editors will be stored
         username_prefix = "{}_img_".format(username)
+        tmp_prefix = "{}_tmp_".format(username)
 
         if restart:
             """
             Loop through all images in img_dir, create enumerated archives for them in archive_dir,
                 and add each enumerated archive filepath to our archives list.
             """
-            # Delete all files in the archive directory with the relevant username if restarting
+            # Delete all files in the archive directory with the relevant username if restarting, along with their
+            # editor renditions
 
             clear_dir(self.archive_dir,
                       lambda f:
                           f.split(os.sep)[-1].startswith(username_prefix) and
-                          f.split(os.sep)[-1][len(username_prefix):-4].isnumeric()
+                          os.path.splitext(f.split(os.sep)[-1])[0][len(username_prefix):].split("_editor")[0].isnumeric()
             )
-            openslide_image_types = {".svs", ".tif", ".vms", ".vmu", ".ndpi", ".scn",
-                                ".mrxs", ".tiff", ".svslide"}
             root = Tk()
             root.title("")
             selection_filetypes = [
@@ -110,8 +81,8 @@ class Images(object):
             ))
             root.destroy()
 
-            # Name of every image after large images have been split into two
-            # or three constituent images
+            # Name of every image after multi-scene .czi images have been split
+            # into their constituent images
             img_names_all = []
             vsi_images = []
             vsi_png_images = []
@@ -154,126 +125,44 @@ class Images(object):
                         os.rename(current_folderpath, original_folderpath)
                 # img_names = [name for name in fnames(self.vsi_img_dir, recursive=False)]
 
-            # Define a callback to be passed to the Asynchronous Progress Bar
+            # Archive every image concurrently across a pool of worker processes. Each worker archives its image
+            # into temporarily named archives, since we don't know how many archives each image will produce until
+            # it is done. Each worker process is replaced after every image so that its memory is released.
+            clear_dir(self.archive_dir, lambda f: f.split(os.sep)[-1].startswith(tmp_prefix))
+            # Spawned rather than forked, like all of our worker pools, since TensorFlow has been imported by now
+            pool = multiprocessing.get_context("spawn").Pool(archive_workers, maxtasksperchild=1)
+            results = [
+                pool.apply_async(archive_src_img, (src_fpath, os.path.join(self.archive_dir, "{}{}_".format(tmp_prefix, i))))
+                for i, src_fpath in enumerate(img_names)
+            ]
+            pool.close()
 
+            # Define a callback to be passed to the Asynchronous Progress Bar. It is called in order, so it waits on
+            # each worker's result in order and renames the resulting archives to their final enumerated names, so
+            # that our archives always end up in the same order as img_names.
             def archive_callback(index):
                 i = index
                 src_fpath = img_names[i]
-                if not os.path.exists(src_fpath):
-                    messagebox.showerror(title="Error", message="Error opening {}: {} does not "
-                                         "exist.".format(os.path.basename(src_fpath),
-                                                                                os.path.basename(src_fpath)))
-                    return
-                fname = os.path.basename(src_fpath)
                 sys.stdout.write("\rArchiving Image {}/{}...".format(
                     i + 1,
                     len(img_names))
                 )
-                # Read src, Check max shape, Create archive at dst, add dst to archive list
-                dst_fpath = os.path.join(self.archive_dir, "{}{}.npy".format(username_prefix, len(self.archives)))
-                thumb_fpath = os.path.join(self.archive_dir, "{}{}_thumbnail.npy".format(username_prefix, len(self.archives)))
-                _, src_suffix = os.path.splitext(src_fpath)
-                if src_suffix in openslide_image_types:
-                    try:
-                        slides = read_openslide_img(src_fpath)
-                    except:
-                        messagebox.showerror(title="Error", message="Error opening {}: {} is not a valid "
-                                                                    "file.".format(os.path.basename(src_fpath),
-                                                                                    os.path.basename(src_fpath)))
-                        return
-
-                    if len(slides) == 2:
-                        dst_fpath_a = dst_fpath
-                        thumb_fpath_a = thumb_fpath
-                        self.archives.append(dst_fpath_a)
-                        self.thumbnails.append(thumb_fpath_a)
-                        img_names_all.append("{} (1)".format(fname))
-                        dst_fpath_b = os.path.join(self.archive_dir, "{}{}.npy".format(username_prefix,
-                                                                                           len(self.archives)))
-                        thumb_fpath_b = os.path.join(self.archive_dir, "{}{}_thumbnail.npy".format(username_prefix,
-                                                                                           len(self.archives)))
-                        self.archives.append(dst_fpath_b)
-                        self.thumbnails.append(thumb_fpath_b)
-                        img_names_all.append("{} (2)".format(fname))
-                        slide_npy_a = np.array(slides[0])
-                        slide_npy_b = np.array(slides[1])
-                        thumbnail_a = cv2.resize(slide_npy_a, (0, 0),
-                                              fx=280 / slide_npy_a.shape[1],
-                                              fy=280 / slide_npy_a.shape[0])
-                        thumbnail_b = cv2.resize(slide_npy_b, (0, 0),
-                                              fx=280 / slide_npy_b.shape[1],
-                                              fy=280 / slide_npy_b.shape[0])
-                        #THUMBNAIL img = cv2.resize(img, dsize=(newsize_y, newsize_x),interpolation=cv2.INTER_CUBIC)
-                        np.save(dst_fpath_a, slide_npy_a)
-                        np.save(dst_fpath_b, slide_npy_b)
-                        np.save(thumb_fpath_a, thumbnail_a)
-                        np.save(thumb_fpath_b, thumbnail_b)
-                    else:
-                        slide_npy = np.array(slides[0])
-                        thumbnail = cv2.resize(slide_npy, (0, 0),
-                                              fx=280 / slide_npy.shape[1],
-                                              fy=280 / slide_npy.shape[0])
-                        np.save(dst_fpath, slide_npy)
-                        np.save(thumb_fpath, thumbnail)
-                        self.archives.append(dst_fpath)
-                        self.thumbnails.append(thumb_fpath)
-                        img_names_all.append(fname)
-                elif src_suffix == '.vsi':
-                    # These should be converted to png before the code gets here
-                    return
-                elif src_suffix == '.czi':
-                    try:
-                        image = czf.imread(src_fpath)
-                    except ValueError:
-                        messagebox.showerror(title="Error", message="Error opening {}: {} "
-                                                                    "is not a valid file.".format(os.path.basename(src_fpath),
-                                                                                    os.path.basename(src_fpath)))
-                        return
-                    count = image.shape[0] * image.shape[1] * image.shape[2]
-                    for i in range(image.shape[0]):
-                        for j in range(image.shape[1]):
-                            for k in range(image.shape[2]):
-                                # resize_image = cv2.resize(image[i, j, k], dsize=(newsize_y, newsize_x),
-                                #                           interpolation=cv2.INTER_CUBIC)
-                                img_npy = np.array(image[i, j, k])
-                                dst_fpath = os.path.join(self.archive_dir, "{}{}.npy".format(username_prefix, len(self.archives)))
-                                thumb_fpath = os.path.join(self.archive_dir, "{}{}_thumbnail.npy".format(username_prefix, len(self.archives)))
-                                thumbnail = cv2.resize(img_npy, (0, 0),
-                                                      fx=280 / img_npy.shape[1],
-                                                      fy=280 / img_npy.shape[0])
-                                np.save(dst_fpath, img_npy)
-                                np.save(thumb_fpath, thumbnail)
-                                self.archives.append(dst_fpath)
-                                self.thumbnails.append(thumb_fpath)
-                                if count > 1:
-                                    img_names_all.append("{} ({})".format(
-                                        fname, i * image.shape[1] * image.shape[2] + j * image.shape[2] + k + 1)
-                                    )
-                                else:
-                                    img_names_all.append(fname)
-                    pass
-                else:  # Primarily png and other images readable by numpy
-                    try:
-                        # img_npy = cv2.imread(src_fpath)
-                        img_npy = read_image_bgr(src_fpath)
-                    except cv2.error as e:
-                        messagebox.showerror(title="Error", message="Error opening {}. {}"
-                                                                    "file.".format(os.path.basename(src_fpath),
-                                                                                    e))
-
-                    if img_npy is None:
-                        messagebox.showerror(title="Error", message="Error opening {}. {} is not a valid "
-                                                                    "file.".format(os.path.basename(src_fpath),
-                                                                                    os.path.basename(src_fpath)))
-                        return
-                    thumbnail = cv2.resize(img_npy, (0, 0),
-                                          fx=280 / img_npy.shape[1],
-                                          fy=280 / img_npy.shape[0])
-                    np.save(dst_fpath, img_npy)
-                    np.save(thumb_fpath, thumbnail)
+                try:
+                    archived, error = results[i].get()
+                except Exception as e:
+                    archived, error = [], "Error opening {}: {}".format(os.path.basename(src_fpath), e)
+                if error is not None:
+                    messagebox.showerror(title="Error", message=error)
+
+                for tmp_dst_fpath, tmp_thumb_fpath, tmp_editor_fpath, name in archived:
+                    dst_fpath = os.path.join(self.archive_dir, "{}{}.h5".format(username_prefix, len(self.archives)))
+                    thumb_fpath = os.path.join(self.archive_dir, "{}{}_thumbnail.npy".format(username_prefix, len(self.archives)))
+                    os.rename(tmp_dst_fpath, dst_fpath)
+                    os.rename(tmp_thumb_fpath, thumb_fpath)
+                    os.rename(tmp_editor_fpath, get_editor_img_fpath(dst_fpath))
                     self.archives.append(dst_fpath)
                     self.thumbnails.append(thumb_fpath)
-                    img_names_all.append(fname)
+                    img_names_all.append(name)
 
             # The root process completes the callback's task while keeping track of progress
             print(len(img_names))
@@ -283,6 +172,7 @@ class Images(object):
                 archive_callback
             )
             root.mainloop()
+            pool.join()
             sys.stdout.flush()
             print("")
 
@@ -319,12 +209,13 @@ class Images(object):
                 # If the defaults haven't been changed, then there is no need to resize.
                 if img_resolutions[i][0] == img_resolutions[i][1] == 0.41:
                     return
-                img = np.load(dst_fpath)
-                newsize_x = int(img.shape[0] / (0.41 / img_resolutions[i][0]))
-                newsize_y = int(img.shape[1] / (0.41 / img_resolutions[i][1]))
-                img = cv2.resize(img, dsize=(newsize_y, newsize_x),
-                           interpolation=cv2.INTER_CUBIC)
-                np.save(dst_fpath, img)
+                archive = SlideArchive(dst_fpath)
+                h, w = archive.shape()[:2]
+                newsize_x = int(h / (0.41 / img_resolutions[i][0]))
+                newsize_y = int(w / (0.41 / img_resolutions[i][1]))
+                # Resized tile by tile, so the slide is never entirely in memory
+                archive.resize((newsize_y, newsize_x), interpolation=cv2.INTER_CUBIC)
+                save_editor_img(archive, get_editor_img_fpath(dst_fpath))
 
 
             root = ProgressRoot(
@@ -342,36 +233,73 @@ class Images(object):
             # use existing archive files
             for fname in fnames(self.archive_dir):
                 fn = fname.split(os.sep)[-1]
-                if fn.startswith(username + '_img_') and fn[len(username_prefix):-4].isnumeric():
+                if fn.startswith(username + '_img_') and os.path.splitext(fn)[0][len(username_prefix):].isnumeric():
                     self.archives.append(os.path.join(self.archive_dir, fname))
 
         # Regardless of this we sort the result, since it depends on the nondeterministic ordering of the os.walk
         # generator in fnames()
         # We have to get the filename integer number, since otherwise we will end up with stuff like 0, 10, 11,
         # 1 instead of 0, 1, 10, 11
-        self.archives = sorted(self.archives, key=lambda x: int(x.split(os.sep)[-1][len(username_prefix):-4]))
+        self.archives = sorted(self.archives, key=lambda x: int(os.path.splitext(x.split(os.sep)[-1])[0][len(username_prefix):]))
+        self.editor_imgs = [get_editor_img_fpath(archive) for archive in self.archives]
 
     def __iter__(self):
-        for archive in self.archives:
-            img = np.load(archive)
+        for i in range(len(self.archives)):
+            img = self[i]
             yield img
 
     def __getitem__(self, i):
-        return np.load(self.archives[i])
+        return SlideArchive(self.archives[i]).read_level(0)
 
     def __setitem__(self, i, img):
-        np.save(self.archives[i], img)
+        archive = SlideArchive(self.archives[i])
+        archive.write(img)
+        save_editor_img(archive, self.editor_imgs[i])  # So the editors don't keep displaying the old image
 
     def __len__(self):
         return len(self.archives)
 
+    def shape(self, i):
+        # Full resolution shape of image i, without loading it.
+        return SlideArchive(self.archives[i]).shape()
+
+    def view(self, i, level=0):
+        # Read-only view of image i at the given level, which only reads the regions it is sliced with.
+        return SlideArchive(self.archives[i]).view(level)
+
+    def read_region(self, i, x1, y1, x2, y2, level=0):
+        # Read only the region of image i with the given full resolution coordinates, from the given level.
+        return SlideArchive(self.archives[i]).read_region(x1, y1, x2, y2, level=level)
+
+    def read_resized(self, i, fx, fy):
+        # Get image i resized by fx and fy, resizing from the lowest resolution level that allows it.
+        return SlideArchive(self.archives[i]).read_resized(fx, fy)
+
+    def resized_view(self, i, fx, fy):
+        # Read-only view of image i resized by fx and fy, which only resizes the regions it is sliced with.
+        return SlideArchive(self.archives[i]).resized_view(fx, fy)
+
+    def read_editor_img(self, i, resize_factor):
+        # Get image i resized by resize_factor for display in an editor, as a read-only memory map of the rendition
+        # saved when image i was archived, so only the regions it's sliced with are read. If the rendition wasn't
+        # saved at this size (e.g. for sessions archived before renditions were saved), it's saved from the archive
+        # first.
+        archive = SlideArchive(self.archives[i])
+        h, w = archive.shape()[:2]
+        if os.path.exists(self.editor_imgs[i]):
+            editor_img = np.load(self.editor_imgs[i], mmap_mode='r')
+            if editor_img.shape[:2] == (int(round(h * resize_factor)), int(round(w * resize_factor))):
+                return editor_img
+            del editor_img  # Closes the memory map, so the rendition can be replaced
+        save_editor_img(archive, self.editor_imgs[i], resize_factor=resize_factor)
+        return np.load(self.editor_imgs[i], mmap_mode='r')
+
     def max_shape(self):
         max_shape = [0, 0, 0]  # maximum dimensions of all images
 
-        # load with mmap mode so we can just get the shape
+        # only read the archive metadata so we can just get the shape
         for archive in self.archives:
-            img = np.load(archive, mmap_mode='r')
-            for i, dim in enumerate(img.shape):
+            for i, dim in enumerate(SlideArchive(archive).shape()):
                 if dim > max_shape[i]:
                     max_shape[i] = dim
         return max_shape
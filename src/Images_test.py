@@ -2,16 +2,18 @@ import numpy as np
 
 from Images import Images
 
-imgs = Images("unit_test", restart=True)
+# Guarded, since worker processes started with the "spawn" method import this module again
+if __name__ == "__main__":
+    imgs = Images("unit_test", restart=True)
 
-for img in imgs:
-    print(img.shape)
-print("Max Shape: ", imgs.max_shape())
+    for img in imgs:
+        print(img.shape)
+    print("Max Shape: ", imgs.max_shape())
 
-print(imgs[3].shape)
-print(np.all(imgs[0] == imgs[-1]))
-imgs[-1] = imgs[0]
-print(np.all(imgs[0] == imgs[-1]))
-print(len(imgs))
+    print(imgs[3].shape)
+    print(np.all(imgs[0] == imgs[-1]))
+    imgs[-1] = imgs[0]
+    print(np.all(imgs[0] == imgs[-1]))
+    print(len(imgs))
 
-imgs = Images("unit_test", restart=False)
+    imgs = Images("unit_test", restart=False)
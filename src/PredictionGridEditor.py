@@ -11,6 +11,10 @@ from Tooltip import createTooltip
 from gui_base import *
 from base import *
 from tktools import center_left_window
+from prefetching import PrefetchCache
+from edit_journal import EditJournal
+from write_behind import WriteBehindSaver
+from tiled_canvas import TiledCanvasImage
 
 
 class PredictionGridEditor(object):
@@ -27,6 +31,9 @@ class PredictionGridEditor(object):
                           (244, 66, 143)]
         self.color_index = 3
         self.title = "L.I.R.A. Prediction Grid Editing"
+        self.prefetch_cache_mb = 1024  # Memory the images prefetched on either side of the current image may use
+        self.max_undos = 100  # Number of edits that can be undone on each image
+        self.autosave_delay = 1.0  # Seconds after the last edit that our edits are saved in the background
 
         self.tools = ["paintbrush", "draw-square", "paint-bucket", "zoom"]
         self.tool_cursors = ["spraycan", "crosshair", "coffee_mug", "target"]
@@ -35,7 +42,10 @@ class PredictionGridEditor(object):
         self.tool_index = 1
         base_dir = os.path.dirname(os.getcwd())
         icon_dir = os.path.join(base_dir, 'icons')
-        # Img + Predictions
+        # Img + Predictions, with the images on either side of the current image prefetched in the background
+        self.img_cache = PrefetchCache(self.load_img_and_predictions, max_mb=self.prefetch_cache_mb)
+        self.journal = EditJournal(max_edits=self.max_undos)  # History of our edits on each image, for undo and redo
+        self.saver = WriteBehindSaver(self.dataset.prediction_grids.after_editing, delay=self.autosave_delay)
         self.reload_img_and_predictions()
 
         # Window + Frame
@@ -53,6 +63,8 @@ class PredictionGridEditor(object):
             height=700,
             scrollregion=(0, 0, self.dataset.imgs.max_shape()[1], self.dataset.imgs.max_shape()[0]),
         )
+        # Only the tiles of the image in view are rendered and kept by Tk, rather than a bitmap of the entire image
+        self.canvas_tiles = TiledCanvasImage(self.main_canvas, self.render_img_section)
 
         # Create palette and toolbar
         self.toolbar = Frame(self.frame)
@@ -67,7 +79,8 @@ class PredictionGridEditor(object):
         vbar = Scrollbar(self.main_canvas_frame, orient=VERTICAL)
         vbar.pack(side=RIGHT, fill=Y)
         vbar.config(command=self.main_canvas.yview)
-        self.main_canvas.config(xscrollcommand=hbar.set, yscrollcommand=vbar.set)
+        self.main_canvas.config(xscrollcommand=self.canvas_tiles.scroll_command(hbar),
+                                yscrollcommand=self.canvas_tiles.scroll_command(vbar))
         buttonFrame = Frame(self.window, bd=5)
         self.finishButton = Button(buttonFrame, text="Continue", command=self.finish_button_press, state=DISABLED)
         if self.dataset.progress["prediction_grids_image"] == len(self.dataset.imgs) - 1:
@@ -95,17 +108,15 @@ class PredictionGridEditor(object):
                                                     len(self.dataset.prediction_grids.before_editing)))
 
         # Img + Event listeners
-        self.main_canvas.image = ImageTk.PhotoImage(
-            Image.fromarray(self.img))  # Literally because tkinter can't handle references properly and needs this.
-        self.main_canvas.config(scrollregion=(0, 0, self.main_canvas.image.width(), self.main_canvas.image.height()))
-        self.main_canvas_image_config = self.main_canvas.create_image(0, 0, image=self.main_canvas.image,
-                                                                      anchor="nw")  # So we can change the image later
+        self.canvas_tiles.reset(self.resized_view.shape[1], self.resized_view.shape[0])
         self.main_canvas.focus_set()
         self.main_canvas.bind_all("<Button-4>", self.mouse_scroll)  # Scrollwheel for entire editor
         self.main_canvas.bind_all("<Button-5>", self.mouse_scroll)  # Scrollwheel for entire editor
         self.main_canvas.bind("<Left>", self.left_arrow_key_press)
         self.main_canvas.bind("<Right>", self.right_arrow_key_press)
         self.main_canvas.bind("<Key>", self.key_press)
+        self.main_canvas.bind("<Control-z>", self.undo)
+        self.main_canvas.bind("<Control-y>", self.redo)
         self.main_canvas.pack(side=TOP)
 
         self.toolButtons = []
@@ -117,6 +128,10 @@ class PredictionGridEditor(object):
         self.buttonFrame.pack(side=LEFT)
 
         self.paintbrush_radius = 3
+        self.paintbrush_refresh_ms = 16  # Minimum time between display updates while painting, i.e. about 60 per second
+        self.paintbrush_x, self.paintbrush_y = 0, 0  # Cell of the last motion event of the current stroke
+        self.paintbrush_dirty = None  # Section (x1, y1, x2, y2) of the grid painted since the last display update
+        self.paintbrush_refresh_id = None  # Scheduled display update, if any
 
         def set_paintbrush_radius(val):
             self.paintbrush_radius = int(val) - 1
@@ -138,7 +153,21 @@ class PredictionGridEditor(object):
             image=self.undo_img
         )
         self.undoButton.pack()
-        self.undos = []
+
+        # The redo icon is the undo icon mirrored
+        self.redo_img = Image.open(os.path.join(icon_dir, "undo-solid.png")).transpose(Image.FLIP_LEFT_RIGHT)
+        self.redo_img = self.redo_img.resize((20, 20), Image.ANTIALIAS)
+        self.redo_img = ImageTk.PhotoImage(self.redo_img)
+        self.redoButton = Button(
+            self.buttonFrame,
+            relief=SUNKEN,
+            state=DISABLED,
+            command=self.redo,
+            bg=icon_color_str,
+            image=self.redo_img
+        )
+        self.redoButton.pack()
+        self.update_undo_buttons()
 
         self.clear_img = Image.open(os.path.join(icon_dir, "eye-slash-solid.png"))
         self.clear_img = self.clear_img.resize((20, 20), Image.ANTIALIAS)
@@ -151,7 +180,8 @@ class PredictionGridEditor(object):
             image=self.clear_img
         )
         self.clearButton.pack()
-        createTooltip(self.undoButton, 'Undo last edit')
+        createTooltip(self.undoButton, 'Undo last edit (Ctrl+Z)')
+        createTooltip(self.redoButton, 'Redo last undone edit (Ctrl+Y)')
         createTooltip(self.clearButton, 'Set all classifications to Healthy Tissue')
 
         def change_tool(index):
@@ -227,61 +257,90 @@ class PredictionGridEditor(object):
         self.add_undo()
 
         self.prediction_grid[self.prediction_grid != 3] = 0
+        self.record_edit(0, 0, self.prediction_grid.shape[1], self.prediction_grid.shape[0])
 
         # Save updated predictions
-        self.dataset.prediction_grids.after_editing[
-            self.dataset.progress["prediction_grids_image"]] = self.prediction_grid
-
-        # Load the resized image section (without any overlay) referenced by our current classification_selection
-        # rectangle (no need to cast to int b/c int*int = int)
-        self.img_section = self.resized_img[:, :]
-
-        # Create new overlay on this resized image section with the prediction grid section
-        self.prediction_overlay_section = np.zeros_like(self.img_section)
-        for row_i, row in enumerate(self.prediction_grid):
-            for col_i, col in enumerate(row):
-                color = self.color_key[col]
-                # draw rectangles of the resized sub_hxsub_w size on it
-                cv2.rectangle(self.prediction_overlay_section, (col_i * self.sub_w, row_i * self.sub_h),
-                              (col_i * self.sub_w + self.sub_w, row_i * self.sub_h + self.sub_h), color, -1)
-
-        # Combine the overlay section and the image section
-        before_img_section = self.img_section
-        self.img_section = weighted_overlay(self.img_section, self.prediction_overlay_section,
-                                            self.editor_transparency_factor)
-        self.img_section = cv2.cvtColor(self.img_section,
-                                        cv2.COLOR_BGR2RGB)  # We need to convert so it will display the proper colors
-
-        # Insert the now-updated image section back into the full image
-        self.img[:, :] = self.img_section
-
-        # And finally update the canvas
-        self.main_canvas.image = ImageTk.PhotoImage(
-            Image.fromarray(self.img))  # Literally because tkinter can't handle references properly and needs this.
-        self.main_canvas.itemconfig(self.main_canvas_image_config, image=self.main_canvas.image)
-
-    def undo(self):
-        if len(self.undos) == 0:
-            return
-        self.prediction_grid, self.img = self.undos.pop()
-        self.dataset.prediction_grids.after_editing[
-            self.dataset.progress["prediction_grids_image"]] = self.prediction_grid
-        self.main_canvas.image = ImageTk.PhotoImage(
-            Image.fromarray(self.img))  # Literally because tkinter can't handle references properly and needs this.
-        self.main_canvas.itemconfig(self.main_canvas_image_config, image=self.main_canvas.image)
-        if len(self.undos) == 0:
-            self.undoButton.config(state=DISABLED, relief=SUNKEN)
+        self.save_predictions()
+
+        # Update the overlay of the entire image on the canvas
+        self.update_img_section(0, 0, self.prediction_grid.shape[1], self.prediction_grid.shape[0])
+
+    def undo(self, event=None):
+        # Undo the last edit on this image, then update the overlay and canvas of only the area it changed
+        self.refresh_paintbrush()
+        bounds = self.journal.undo(self.dataset.progress["prediction_grids_image"], self.prediction_grid)
+        if bounds is not None:
+            self.apply_journal_change(*bounds)
+        self.update_undo_buttons()
+
+    def redo(self, event=None):
+        # Redo the last undone edit on this image, then update the overlay and canvas of only the area it changed
+        self.refresh_paintbrush()
+        bounds = self.journal.redo(self.dataset.progress["prediction_grids_image"], self.prediction_grid)
+        if bounds is not None:
+            self.apply_journal_change(*bounds)
+        self.update_undo_buttons()
+
+    def apply_journal_change(self, grid_x1, grid_y1, grid_x2, grid_y2):
+        # After our journal changed the prediction grid section grid_y1:grid_y2, grid_x1:grid_x2 by undoing or
+        # redoing an edit, save it and update the display of that section
+        self.recorded_grid[grid_y1:grid_y2, grid_x1:grid_x2] = self.prediction_grid[grid_y1:grid_y2, grid_x1:grid_x2]
+        self.save_predictions()
+        self.update_img_section(grid_x1, grid_y1, grid_x2, grid_y2)
+
+    def save_predictions(self):
+        # Queue our current predictions to be saved in the background, once we stop editing for a moment
+        try:
+            self.saver.save(self.dataset.progress["prediction_grids_image"], self.prediction_grid)
+        except Exception as e:
+            # An earlier save failed in the background. It's retried, but the user should know their edits aren't
+            # on disk yet.
+            self.show_save_error(e)
+
+    def save_before_switching(self):
+        # Save our current predictions now, and keep them in our cache in case we come back to this image.
+        # Returns False if they couldn't be saved, after showing the error, in which case we stay on this image.
+        self.refresh_paintbrush()
+        self.save_predictions()
+        try:
+            self.saver.flush()
+        except Exception as e:
+            self.show_save_error(e)
+            return False
+        self.img_cache.put(self.dataset.progress["prediction_grids_image"],
+                           (self.resized_view, self.prediction_grid, self.fx, self.fy))
+        return True
+
+    def show_save_error(self, e):
+        messagebox.showerror(
+            "Error Saving Edits",
+            "Your edits to this image could not be saved, and will be saved again shortly: {}".format(e))
 
     def add_undo(self):
-        if len(self.undos) == 0:
+        # Start a new edit in our journal, which every change recorded until the next call is part of, so that
+        # they're all undone at once
+        self.journal.begin(self.dataset.progress["prediction_grids_image"])
+
+    def record_edit(self, grid_x1, grid_y1, grid_x2, grid_y2):
+        # Record the changes made to the prediction grid section grid_y1:grid_y2, grid_x1:grid_x2 since it was last
+        # recorded into the current edit in our journal. self.recorded_grid keeps the state of the grid as of our
+        # last record, so we only have to compare the section that was edited.
+        old = self.recorded_grid[grid_y1:grid_y2, grid_x1:grid_x2]
+        new = self.prediction_grid[grid_y1:grid_y2, grid_x1:grid_x2]
+        self.journal.record(self.dataset.progress["prediction_grids_image"], grid_x1, grid_y1, old, new)
+        old[:] = new
+        self.update_undo_buttons()
+
+    def update_undo_buttons(self):
+        # Enable the undo and redo buttons only if there's something on this image to undo or redo
+        if self.journal.can_undo(self.dataset.progress["prediction_grids_image"]):
             self.undoButton.config(state=NORMAL, relief=FLAT)
-        self.undos.append((np.copy(self.prediction_grid), np.copy(self.img)))
-        if len(self.undos) > 20:
-            self.undos = self.undos[1:]
-
-    def clear_undos(self):
-        self.undos = []
-        self.undoButton.config(state=DISABLED, relief=SUNKEN)
+        else:
+            self.undoButton.config(state=DISABLED, relief=SUNKEN)
+        if self.journal.can_redo(self.dataset.progress["prediction_grids_image"]):
+            self.redoButton.config(state=NORMAL, relief=FLAT)
+        else:
+            self.redoButton.config(state=DISABLED, relief=SUNKEN)
 
     def changeColor(self, index):
         if index >= len(self.paletteButtons):
@@ -306,6 +365,7 @@ class PredictionGridEditor(object):
         if self.tools[index] == "paintbrush":
             self.main_canvas.bind("<Button 1>", self.paintbrush_click)  # mouse_click
             self.main_canvas.bind("<B1-Motion>", self.paintbrush_move)  # mouse_move
+            self.main_canvas.bind("<ButtonRelease-1>", self.paintbrush_release)  # mouse_left_release
             self.main_canvas.bind("<Motion>", self.paintbrush_move_outline)  # mouse_move
             self.main_canvas.bind("<Leave>", self.paintbrush_leave)  # mouse_move
             self.scaleFrame.pack(side=LEFT, padx=10)
@@ -324,35 +384,64 @@ class PredictionGridEditor(object):
 
     # The following functions are event handlers for our editing window.
     def paintbrush_click(self, event):
+        # Start a new stroke, which is a single edit however long it's dragged for
         self.add_undo()
-        self.paintbrush_move(event)
+        self.paintbrush_x, self.paintbrush_y = self.get_paintbrush_cell(event)
+        self.paint_stroke(self.paintbrush_x, self.paintbrush_y)
+        self.paintbrush_move_outline(event)
 
     def paintbrush_move(self, event):
-
-        self.selection_x1, self.selection_y1 = get_canvas_coordinates(
-            event)  # Get rectangle coordinates from our initial mouse click point to this point
-        rect_x1, rect_y1, rect_x2, rect_y2 = get_rectangle_coordinates(
-            self.selection_x1, self.selection_y1,
-            self.selection_x1, self.selection_y1
-        )
-
-        # Get coordinates for a new rectangle outline with this new rectangle
-        outline_rect_x1, outline_rect_y1, outline_rect_x2, outline_rect_y2 = get_outline_rectangle_coordinates(
-            rect_x1,
-            rect_y1,
-            rect_x2,
-            rect_y2,
-            self.sub_h,
-            self.sub_w
-        )
-        self.prediction_rect_x1 = int(outline_rect_x1 / self.sub_w) - self.paintbrush_radius
-        if self.prediction_rect_x1 < 0: self.prediction_rect_x1 = 0
-        self.prediction_rect_y1 = int(outline_rect_y1 / self.sub_h) - self.paintbrush_radius
-        if self.prediction_rect_y1 < 0: self.prediction_rect_y1 = 0
-        self.prediction_rect_x2 = int(outline_rect_x2 / self.sub_w) + self.paintbrush_radius
-        self.prediction_rect_y2 = int(outline_rect_y2 / self.sub_h) + self.paintbrush_radius
+        # Paint the brush along the line from the cell of the last motion event to this one, so fast drags don't
+        # leave gaps between events
+        cell_x, cell_y = self.get_paintbrush_cell(event)
+        if (cell_x, cell_y) != (self.paintbrush_x, self.paintbrush_y):
+            self.paint_stroke(cell_x, cell_y)
+            self.paintbrush_x, self.paintbrush_y = cell_x, cell_y
         self.paintbrush_move_outline(event)
-        self.fill_selected_area()
+
+    def paintbrush_release(self, event):
+        # Show the end of the stroke now rather than at the next refresh
+        self.refresh_paintbrush()
+
+    def get_paintbrush_cell(self, event):
+        # Prediction grid cell under the mouse
+        canvas_x, canvas_y = get_canvas_coordinates(event)
+        return int(canvas_x // self.sub_w), int(canvas_y // self.sub_h)
+
+    def paint_stroke(self, cell_x, cell_y):
+        # Paint the brush from (self.paintbrush_x, self.paintbrush_y) to (cell_x, cell_y) onto the prediction grid.
+        # The display is only updated on the next refresh, with everything painted since the last one.
+        mask_x1, mask_y1, mask = get_brush_stroke(self.paintbrush_x, self.paintbrush_y, cell_x, cell_y,
+                                                  self.paintbrush_radius)
+        grid_x1, grid_y1 = max(mask_x1, 0), max(mask_y1, 0)
+        grid_x2 = min(mask_x1 + mask.shape[1], self.prediction_grid.shape[1])
+        grid_y2 = min(mask_y1 + mask.shape[0], self.prediction_grid.shape[0])
+        if grid_x2 <= grid_x1 or grid_y2 <= grid_y1:
+            return
+        mask = mask[grid_y1 - mask_y1:grid_y2 - mask_y1, grid_x1 - mask_x1:grid_x2 - mask_x1]
+        self.prediction_grid[grid_y1:grid_y2, grid_x1:grid_x2][mask] = self.color_index
+
+        # Grow the section painted since the last refresh to include this, and schedule a refresh if there isn't one
+        if self.paintbrush_dirty is not None:
+            dirty_x1, dirty_y1, dirty_x2, dirty_y2 = self.paintbrush_dirty
+            grid_x1, grid_y1 = min(grid_x1, dirty_x1), min(grid_y1, dirty_y1)
+            grid_x2, grid_y2 = max(grid_x2, dirty_x2), max(grid_y2, dirty_y2)
+        self.paintbrush_dirty = (grid_x1, grid_y1, grid_x2, grid_y2)
+        if self.paintbrush_refresh_id is None:
+            self.paintbrush_refresh_id = self.window.after(self.paintbrush_refresh_ms, self.refresh_paintbrush)
+
+    def refresh_paintbrush(self):
+        # Record, save and display everything painted since the last refresh, as one section
+        if self.paintbrush_refresh_id is not None:
+            self.window.after_cancel(self.paintbrush_refresh_id)
+            self.paintbrush_refresh_id = None
+        if self.paintbrush_dirty is None:
+            return
+        grid_x1, grid_y1, grid_x2, grid_y2 = self.paintbrush_dirty
+        self.paintbrush_dirty = None
+        self.record_edit(grid_x1, grid_y1, grid_x2, grid_y2)
+        self.save_predictions()
+        self.update_img_section(grid_x1, grid_y1, grid_x2, grid_y2)
 
     def paintbrush_move_outline(self, event):
 
@@ -477,86 +566,22 @@ class PredictionGridEditor(object):
             self.prediction_rect_x2 += 1
         if self.prediction_rect_y1 == self.prediction_rect_y2:
             self.prediction_rect_y2 += 1
-        i = self.color_index
-        square_color_i = self.prediction_grid[self.prediction_rect_y1:self.prediction_rect_y2,
-                         self.prediction_rect_x1:self.prediction_rect_x2][0][0]
+        if self.prediction_rect_x1 >= self.prediction_grid.shape[1] or \
+                self.prediction_rect_y1 >= self.prediction_grid.shape[0]:
+            return
 
-        # Save updated predictions
-        fill_bound_x1 = self.prediction_rect_x1
-        fill_bound_x2 = self.prediction_rect_x2
-        fill_bound_y1 = self.prediction_rect_y1
-        fill_bound_y2 = self.prediction_rect_y2
-
-        # take care of filling adjacent squares with an iterative implementation
-        # of recursion, using a stack because Python is scared of normal recursion
-
-        rect_stack = [(self.prediction_rect_x1, self.prediction_rect_x2,
-                       self.prediction_rect_y1, self.prediction_rect_y2)]
-        while len(rect_stack) > 0:
-            rect_x1, rect_x2, rect_y1, rect_y2 = rect_stack.pop()
-            new_i = self.color_index
-            if new_i == square_color_i:
-                continue
-            if rect_x1 < 0 or rect_y1 < 0 or \
-                    rect_x2 > self.prediction_grid.shape[1] or rect_y2 > self.prediction_grid.shape[0]:
-                continue
-            if fill_bound_x1 > rect_x1:
-                fill_bound_x1 = rect_x1
-            if fill_bound_x2 < rect_x2:
-                fill_bound_x2 = rect_x2
-            if fill_bound_y1 > rect_y1:
-                fill_bound_y1 = rect_y1
-            if fill_bound_y2 < rect_y2:
-                fill_bound_y2 = rect_y2
-            self.prediction_grid[rect_y1:rect_y2, rect_x1:rect_x2] = new_i
-            if rect_x2 + 1 <= self.prediction_grid.shape[1] and \
-                    self.prediction_grid[rect_y1:rect_y2, rect_x1 + 1:rect_x2 + 1][0][
-                        0] == square_color_i:
-                rect_stack.append((rect_x1 + 1, rect_x2 + 1, rect_y1, rect_y2))
-            if rect_x1 - 1 >= 0 and \
-                    self.prediction_grid[rect_y1:rect_y2, rect_x1 - 1:rect_x2 - 1][0][0].item() == square_color_i:
-                rect_stack.append((rect_x1 - 1, rect_x2 - 1, rect_y1, rect_y2))
-            if rect_y2 + 1 <= self.prediction_grid.shape[0] and \
-                    self.prediction_grid[rect_y1 + 1:rect_y2 + 1, rect_x1:rect_x2][0][0].item() == square_color_i:
-                rect_stack.append((rect_x1, rect_x2, rect_y1 + 1, rect_y2 + 1))
-            if rect_y1 - 1 >= 0 and \
-                    self.prediction_grid[rect_y1 - 1:rect_y2 - 1, rect_x1:rect_x2][0][0].item() == square_color_i:
-                rect_stack.append((rect_x1, rect_x2, rect_y1 - 1, rect_y2 - 1))
-
-        self.dataset.prediction_grids.after_editing[
-            self.dataset.progress["prediction_grids_image"]] = self.prediction_grid
-        img_section = self.resized_img[
-                      fill_bound_y1 * self.sub_h:fill_bound_y2 * self.sub_h,
-                      fill_bound_x1 * self.sub_w:fill_bound_x2 * self.sub_w
-                      ]
-        prediction_grid_section = self.prediction_grid[
-                                  fill_bound_y1:fill_bound_y2,
-                                  fill_bound_x1:fill_bound_x2
-                                  ]
-        prediction_overlay_section = np.zeros_like(img_section)
-        for row_i, row in enumerate(prediction_grid_section):
-            for col_i, col in enumerate(row):
-                color = self.color_key[col]
-                # draw rectangles of the resized sub_hxsub_w size on it
-                cv2.rectangle(
-                    prediction_overlay_section,
-                    (col_i * self.sub_w, row_i * self.sub_h),
-                    (col_i * self.sub_w + self.sub_w, row_i * self.sub_h + self.sub_h),
-                    color,
-                    -1
-                )
-
-        img_section = weighted_overlay(img_section, prediction_overlay_section,
-                                       self.editor_transparency_factor)
-        img_section = cv2.cvtColor(img_section,
-                                   cv2.COLOR_BGR2RGB)
-        self.img[fill_bound_y1 * self.sub_h:fill_bound_y2 * self.sub_h,
-                 fill_bound_x1 * self.sub_w:fill_bound_x2 * self.sub_w] = img_section
+        # Fill every cell 4-connected to this one with the same classification, getting the bounds of the area filled
+        fill_bounds = flood_fill(self.prediction_grid, self.prediction_rect_x1, self.prediction_rect_y1,
+                                 self.color_index)
+        if fill_bounds is None:
+            return
+        fill_bound_x1, fill_bound_y1, fill_bound_x2, fill_bound_y2 = fill_bounds
+
+        self.save_predictions()
+        self.record_edit(fill_bound_x1, fill_bound_y1, fill_bound_x2, fill_bound_y2)
 
-        # And finally update the canvas
-        self.main_canvas.image = ImageTk.PhotoImage(
-            Image.fromarray(self.img))  # Literally because tkinter can't handle references properly and needs this.
-        self.main_canvas.itemconfig(self.main_canvas_image_config, image=self.main_canvas.image)
+        # Update the overlay of only the area we filled, and finally update only that area of the canvas
+        self.update_img_section(fill_bound_x1, fill_bound_y1, fill_bound_x2, fill_bound_y2)
 
     def zoom_click(self, event):
         # Start a selection rect. Our rectangle selections can only be made up of small rectangles of size
@@ -643,23 +668,20 @@ class PredictionGridEditor(object):
                                                    len(self.dataset.prediction_grids.before_editing)))
         self.window.update()
 
-        # Reload self.img and self.prediction_grid
+        # Reload self.resized_img and self.prediction_grid
         self.reload_img_and_predictions()
 
-        # Reload image displayed on canvas and predictions displayed on canvas with self.img and
-        # self.prediction_grids
-        self.main_canvas.image = ImageTk.PhotoImage(
-            Image.fromarray(self.img))  # Literally because tkinter can't handle references properly and needs this.
-        self.main_canvas.itemconfig(self.main_canvas_image_config, image=self.main_canvas.image)
+        # Display the new image and its predictions on the canvas, from its top-left corner
+        self.canvas_tiles.reset(self.resized_img.shape[1], self.resized_img.shape[0])
         self.main_canvas.delete("view_selection")
         self.main_canvas.delete("classification_selection")
 
+        # Our journal keeps the history of each image, so show whether this image has any to undo or redo
+        self.update_undo_buttons()
+
         # Indicate finished loading
         self.window.title("{} - Image {}/{}".format(self.title, self.dataset.progress["prediction_grids_image"] + 1,
                                                     len(self.dataset.prediction_grids.before_editing)))
-        self.main_canvas.config(scrollregion=(0, 0, self.main_canvas.image.width(), self.main_canvas.image.height()))
-        self.main_canvas.yview_moveto(0)
-        self.main_canvas.xview_moveto(0)
 
     def left_arrow_key_press(self, event=None):
         # prevent multiple simultaneous calls
@@ -668,19 +690,19 @@ class PredictionGridEditor(object):
         # Move to the image with index i-1, unless i = 0, in which case we do nothing. AKA the previous image.
         if self.dataset.progress["prediction_grids_image"] > 0:
             self.updating_img = True
-            self.clear_undos()
-            # Save current predictions
-            self.dataset.prediction_grids.after_editing[
-                self.dataset.progress["prediction_grids_image"]] = self.prediction_grid
-
-            # Change current editing image
-            self.dataset.progress["prediction_grids_image"] -= 1
-            if self.dataset.progress["prediction_grids_image"] == 0:
-                self.leftButton.pack_forget()
-            if self.dataset.progress["prediction_grids_image"] == len(self.dataset.imgs) - 2:
-                self.rightButton.pack(side=RIGHT)
-            self.update_img()
-            self.updating_img = False
+            try:
+                if not self.save_before_switching():
+                    return
+
+                # Change current editing image
+                self.dataset.progress["prediction_grids_image"] -= 1
+                if self.dataset.progress["prediction_grids_image"] == 0:
+                    self.leftButton.pack_forget()
+                if self.dataset.progress["prediction_grids_image"] == len(self.dataset.imgs) - 2:
+                    self.rightButton.pack(side=RIGHT)
+                self.update_img()
+            finally:
+                self.updating_img = False
 
     def right_arrow_key_press(self, event=None):
         # prevent multiple simultaneous calls
@@ -689,20 +711,20 @@ class PredictionGridEditor(object):
         # Move to the image with index i+1, unless i = img #-1, in which case we do nothing. AKA the next image.
         if self.dataset.progress["prediction_grids_image"] < len(self.dataset.imgs) - 1:
             self.updating_img = True
-            self.clear_undos()
-            # Save current predictions
-            self.dataset.prediction_grids.after_editing[
-                self.dataset.progress["prediction_grids_image"]] = self.prediction_grid
-
-            # Change current editing image
-            self.dataset.progress["prediction_grids_image"] += 1
-            if self.dataset.progress["prediction_grids_image"] == len(self.dataset.imgs) - 1:
-                self.rightButton.pack_forget()
-                self.finishButton.config(state=NORMAL)
-            if self.dataset.progress["prediction_grids_image"] == 1:
-                self.leftButton.pack(side=LEFT)
-            self.update_img()
-            self.updating_img = False
+            try:
+                if not self.save_before_switching():
+                    return
+
+                # Change current editing image
+                self.dataset.progress["prediction_grids_image"] += 1
+                if self.dataset.progress["prediction_grids_image"] == len(self.dataset.imgs) - 1:
+                    self.rightButton.pack_forget()
+                    self.finishButton.config(state=NORMAL)
+                if self.dataset.progress["prediction_grids_image"] == 1:
+                    self.leftButton.pack(side=LEFT)
+                self.update_img()
+            finally:
+                self.updating_img = False
 
     def fill_selected_area(self):
         # Change currently selected area to this classification. We update the prediction grid, but we also update
@@ -717,50 +739,33 @@ class PredictionGridEditor(object):
         ] = i
         self.prediction_grid_section = self.prediction_grid[self.prediction_rect_y1:self.prediction_rect_y2,
                                        self.prediction_rect_x1:self.prediction_rect_x2]
+        self.record_edit(self.prediction_rect_x1, self.prediction_rect_y1,
+                         self.prediction_rect_x2, self.prediction_rect_y2)
 
         # Save updated predictions
-        self.dataset.prediction_grids.after_editing[
-            self.dataset.progress["prediction_grids_image"]] = self.prediction_grid
+        self.save_predictions()
 
         # if the rectangle is flat in either dimension, nothing should happen.
         if self.prediction_rect_y2 == self.prediction_rect_y1 or self.prediction_rect_x2 == self.prediction_rect_x1:
             return
 
-        # Load the resized image section (without any overlay) referenced by our current classification_selection
-        # rectangle (no need to cast to int b/c int*int = int)
-        self.img_section = self.resized_img[self.prediction_rect_y1 * self.sub_h:self.prediction_rect_y2 * self.sub_h,
-                           self.prediction_rect_x1 * self.sub_w:self.prediction_rect_x2 * self.sub_w]
-
-        # Create new overlay on this resized image section with the prediction grid section
-        self.prediction_overlay_section = np.zeros_like(self.img_section)
-        for row_i, row in enumerate(self.prediction_grid_section):
-            for col_i, col in enumerate(row):
-                color = self.color_key[col]
-                # draw rectangles of the resized sub_hxsub_w size on it
-                cv2.rectangle(self.prediction_overlay_section, (col_i * self.sub_w, row_i * self.sub_h),
-                              (col_i * self.sub_w + self.sub_w, row_i * self.sub_h + self.sub_h), color, -1)
-
-        # Combine the overlay section and the image section
-        before_img_section = self.img_section
-        self.img_section = weighted_overlay(self.img_section, self.prediction_overlay_section,
-                                            self.editor_transparency_factor)
-        self.img_section = cv2.cvtColor(self.img_section,
-                                        cv2.COLOR_BGR2RGB)  # We need to convert so it will display the proper colors
-
-        # Insert the now-updated image section back into the full image
-        self.img[self.prediction_rect_y1 * self.sub_h:self.prediction_rect_y2 * self.sub_h,
-        self.prediction_rect_x1 * self.sub_w:self.prediction_rect_x2 * self.sub_w] = self.img_section
-
-        # And finally update the canvas
-        self.main_canvas.image = ImageTk.PhotoImage(
-            Image.fromarray(self.img))  # Literally because tkinter can't handle references properly and needs this.
-        self.main_canvas.itemconfig(self.main_canvas_image_config, image=self.main_canvas.image)
+        # Update the overlay of only the selected area, and finally update only that area of the canvas
+        self.update_img_section(self.prediction_rect_x1, self.prediction_rect_y1,
+                                                    self.prediction_rect_x2, self.prediction_rect_y2)
 
     def q_key_press(self, event=None):
         if messagebox.askquestion(
                 'Quit',
                 'Would you like to quit?'
         ) == 'yes':
+            self.refresh_paintbrush()
+            try:
+                self.saver.close()
+            except Exception as e:
+                # Stay open, so the user can quit again once their edits are saved
+                self.show_save_error(e)
+                return
+            self.img_cache.close()
             sys.exit("Exiting...")
 
     def finish_button_press(self, event=None):
@@ -768,6 +773,14 @@ class PredictionGridEditor(object):
                 "Save and Continue",
                 "Would you like to save and generate displayable results? Once you continue, your edits can not be "
                 "undone."):
+            self.refresh_paintbrush()
+            try:
+                self.saver.close()
+            except Exception as e:
+                # Stay open, so the user can continue again once their edits are saved
+                self.show_save_error(e)
+                return
+            self.img_cache.close()
             self.window.destroy()
             self.dataset.progress["prediction_grids_finished_editing"] = True
 
@@ -781,37 +794,75 @@ class PredictionGridEditor(object):
             self.changeColor(i)
 
     # The following functions are helper functions specific to this editor. All other GUI helpers are in the gui_base.py file.
+    def load_img_and_predictions(self, i):
+        # Load a view of image i resized for display, along with its prediction grid and the factors it's resized by.
+        # Called on our PrefetchCache's background thread, so this can't touch tkinter or our current image.
+        sub_h = int(self.dataset.prediction_grids.sub_h * self.editor_resize_factor)
+        sub_w = int(self.dataset.prediction_grids.sub_w * self.editor_resize_factor)
+        img_shape = self.dataset.imgs.shape(i)
+        prediction_grid = self.dataset.prediction_grids.after_editing[i]  # Load prediction grid
+
+        # Since our image and predictions would be slightly misalgned from each other due to rounding,
+        # We compute the fx and fy img resize factors according to sub_h and sub_w to make them aligned.
+        fy = (prediction_grid.shape[0] * sub_h) / img_shape[0]
+        fx = (prediction_grid.shape[1] * sub_w) / img_shape[1]
+        # Only the sections of the resized img in view are resized, by render_img_section
+        resized_view = self.dataset.imgs.resized_view(i, fx, fy)
+        return resized_view, prediction_grid, fx, fy
+
     def reload_img_and_predictions(self):
-        # Updates the self.img and self.predictions attributes.
+        # Updates the self.resized_view and self.prediction_grid attributes.
 
         # Also updates sub_h and sub_w since the prediction overlay depends on these
         self.sub_h = int(self.dataset.prediction_grids.sub_h * self.editor_resize_factor)
         self.sub_w = int(self.dataset.prediction_grids.sub_w * self.editor_resize_factor)
 
-        self.img = self.dataset.imgs[self.dataset.progress["prediction_grids_image"]]  # Load img
-        self.prediction_grid = self.dataset.prediction_grids.after_editing[
-            self.dataset.progress["prediction_grids_image"]]  # Load prediction grid
+        # Get the resized img view and prediction grid from our cache, which has them ready if they were prefetched.
+        self.resized_view, self.prediction_grid, self.fx, self.fy = self.img_cache.get(
+            self.dataset.progress["prediction_grids_image"])
+        self.recorded_grid = np.copy(self.prediction_grid)  # Prediction grid as of the last edit in our journal
+
+        # Prefetch the images the user can switch to from here while they edit this one
+        i = self.dataset.progress["prediction_grids_image"]
+        self.img_cache.prefetch([j for j in (i + 1, i - 1) if 0 <= j < len(self.dataset.imgs)])
+
+    def get_img_section_coordinates(self, grid_x1, grid_y1, grid_x2, grid_y2):
+        # Get the coordinates x1, y1, x2, y2 of the section of the resized image covered by the prediction grid section
+        # grid_y1:grid_y2, grid_x1:grid_x2.
+        x1 = grid_x1 * self.sub_w
+        y1 = grid_y1 * self.sub_h
+        # Sections reaching the end of the grid reach the end of the image, which can be a pixel past the grid
+        x2 = grid_x2 * self.sub_w if grid_x2 < self.prediction_grid.shape[1] else self.resized_view.shape[1]
+        y2 = grid_y2 * self.sub_h if grid_y2 < self.prediction_grid.shape[0] else self.resized_view.shape[0]
+        return x1, y1, x2, y2
+
+    def update_img_section(self, grid_x1, grid_y1, grid_x2, grid_y2):
+        # Re-draw the section of the canvas covered by the prediction grid section grid_y1:grid_y2, grid_x1:grid_x2,
+        # after the predictions there have changed. Only this section is re-drawn, since updating the entire image is
+        # very expensive and should be avoided.
+        self.canvas_tiles.update(*self.get_img_section_coordinates(grid_x1, grid_y1, grid_x2, grid_y2))
+
+    def render_img_section(self, x1, y1, x2, y2):
+        # Get the section y1:y2, x1:x2 of the resized image with our prediction overlay on it, for display.
+        # The overlay is made for the prediction grid section covering it, then cropped to the section. Sections past
+        # the end of the grid are covered by its last row and column, which also cover the pixel past the grid.
+        grid_x1 = min(x1 // self.sub_w, self.prediction_grid.shape[1] - 1)
+        grid_y1 = min(y1 // self.sub_h, self.prediction_grid.shape[0] - 1)
+        grid_x2, grid_y2 = -(-x2 // self.sub_w), -(-y2 // self.sub_h)
+        grid_img_x1, grid_img_y1, grid_img_x2, grid_img_y2 = self.get_img_section_coordinates(grid_x1, grid_y1,
+                                                                                              grid_x2, grid_y2)
+
+        # Resize the image section (without any overlay) from the archive, and make a new overlay for it with the
+        # prediction grid section
+        img_section = self.resized_view[grid_img_y1:grid_img_y2, grid_img_x1:grid_img_x2]
+        prediction_overlay_section = get_prediction_overlay(self.prediction_grid[grid_y1:grid_y2, grid_x1:grid_x2],
+                                                            self.color_key, self.sub_h, self.sub_w, img_section.shape)
 
-        # Since our image and predictions would be slightly misalgned from each other due to rounding,
-        # We compute the fx and fy img resize factors according to sub_h and sub_w to make them aligned.
-        self.fy = (self.prediction_grid.shape[0] * self.sub_h) / self.img.shape[0]
-        self.fx = (self.prediction_grid.shape[1] * self.sub_w) / self.img.shape[1]
-        self.img = cv2.resize(self.img, (0, 0), fx=self.fx, fy=self.fy)  # Resize img
-        self.resized_img = self.img  # Save this so we don't have to resize later
-
-        # Make overlay to store prediction rectangles on before overlaying on top of image
-        self.prediction_overlay = np.zeros_like(self.img)
-
-        for row_i, row in enumerate(self.prediction_grid):
-            for col_i, col in enumerate(row):
-                color = self.color_key[col]
-                # draw rectangles of the resized sub_hxsub_w size on it
-                cv2.rectangle(self.prediction_overlay, (col_i * self.sub_w, row_i * self.sub_h),
-                              (col_i * self.sub_w + self.sub_w, row_i * self.sub_h + self.sub_h), color, -1)
-
-        self.img = weighted_overlay(self.img, self.prediction_overlay,
-                                    self.editor_transparency_factor)  # Overlay prediction grid onto image
-        self.img = cv2.cvtColor(self.img, cv2.COLOR_BGR2RGB)  # We need to convert so it will display the proper colors
+        # Combine the overlay section and the image section
+        img_section = weighted_overlay(img_section, prediction_overlay_section, self.editor_transparency_factor)
+        img_section = cv2.cvtColor(img_section,
+                                   cv2.COLOR_BGR2RGB)  # We need to convert so it will display the proper colors
+        return img_section[y1 - grid_img_y1:y2 - grid_img_y1, x1 - grid_img_x1:x2 - grid_img_x1]
 
     def display_image_section(self, x1, y1, x2, y2):
         # Given coordinates for an image section on the current resized image, get the coordinates for an image section on the full-resolution / non-resized image,
@@ -823,8 +874,8 @@ class PredictionGridEditor(object):
         x2 = int(x2 / self.fx)
         y2 = int(y2 / self.fy)
 
-        # Get image section
-        self.img_section = self.dataset.imgs[self.dataset.progress["prediction_grids_image"]][y1:y2, x1:x2]
+        # Get image section from a read-only view of the full resolution image, so only this region is read
+        self.img_section = self.dataset.imgs.view(self.dataset.progress["prediction_grids_image"])[y1:y2, x1:x2]
 
         # Display image section on a new tkinter window
         top = Toplevel()
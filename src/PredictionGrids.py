@@ -1,25 +1,27 @@
 import sys
+import os
+import queue
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
-from keras.models import load_model
 import cv2
 
 from base import *
-from EditingDataset import EditingDataset
+from EditingDataset import EditingDataset, save_archive
 from ImageSubsections import ImageSubsections
 from PredictionGridEditor import PredictionGridEditor
-from post_processing import denoise_predictions
+from post_processing import denoise_predictions, get_neumann_error, get_neumann_error_bound
+from batch_sizing import get_batch_size
+from inference_runtime import load_classifier
+from SlideArchive import SlideArchive
 from ProgressBar import TwoLayerProgress
 
 
-def get_lung_contours(img):
-    height, width, depth = img.shape
-
-    scale = 0.05
-    newWidth, newHeight = int(width * scale), int(height * scale)
-    # print(newWidth, newHeight)
-    small_im = cv2.resize(img, (newWidth, newHeight))
-
+def get_lung_contours(small_im, scale):
+    # small_im is the full resolution image already resized by scale, so that we never need to resize the full
+    # resolution image here. The returned contours are in full resolution coordinates.
     blurred = cv2.GaussianBlur(small_im, (1, 1), 0)
     hsv = cv2.cvtColor(blurred, cv2.COLOR_BGR2HSV)
 
@@ -38,6 +40,254 @@ def get_lung_contours(img):
     return contourlist
 
 
+def get_out_contour_mask(lung_contours, prediction_h, prediction_w, sub_h, sub_w):
+    """
+    Get a mask of shape (prediction_h, prediction_w) which is True for each subsection of the prediction grid that
+        lies outside every lung contour, where a subsection is inside if any of its four corners is strictly inside
+        (cv2.pointPolygonTest > 0) any of the contours.
+
+    Since neighbouring subsections share corners, we only test the (prediction_h+1) x (prediction_w+1) lattice of
+        corners. We get most of them by filling each contour at the resolution of this lattice, and only test the
+        corners near the edge of each contour with cv2.pointPolygonTest, since rasterizing can only be wrong near
+        the edge.
+    """
+    corner_inside = np.zeros((prediction_h + 1, prediction_w + 1), dtype=np.uint8)
+    scale = np.array([1. / sub_w, 1. / sub_h], dtype=np.float32)
+    shift = 8  # Fractional bits for subpixel accuracy when drawing
+    for contour in lung_contours:
+        # Contour points in corner lattice coordinates, in fixed point for cv2 drawing.
+        points = np.round(np.reshape(contour, (-1, 2)) * scale * (1 << shift)).astype(np.int32)
+
+        filled = np.zeros_like(corner_inside)
+        cv2.fillPoly(filled, [points], 1, shift=shift)
+
+        edge = np.zeros_like(corner_inside)
+        cv2.polylines(edge, [points], True, 1, shift=shift)
+        edge = cv2.dilate(edge, np.ones((5, 5), dtype=np.uint8))
+
+        # Test the corners near the edge exactly
+        for r, c in zip(*np.nonzero(edge)):
+            filled[r, c] = cv2.pointPolygonTest(contour, (float(c * sub_w), float(r * sub_h)), False) > 0
+        corner_inside |= filled
+
+    # A subsection is inside if any of its four corners are
+    inside = corner_inside[:-1, :-1] | corner_inside[1:, :-1] | corner_inside[:-1, 1:] | corner_inside[1:, 1:]
+    return np.logical_not(inside)
+
+
+def get_subsection_indices(img_shape, small_img, detections, sub_h, sub_w):
+    """
+    Work out which subsections of an image go to which classifier.
+
+    Arguments:
+        img_shape: Full resolution shape of the image
+        small_img: The image resized by 0.05, to get lung contours from
+        detections: The image's type-one detections after editing, as a np array of (x1, y1, x2, y2, ...) rows
+        sub_h, sub_w: Size of each subsection
+
+    Returns:
+        (prediction_h, prediction_w, type_one_subsection_indices, non_type_one_subsection_indices), where the indices
+            are into the image's subsections flattened row by row, as in ImageSubsections.
+    """
+    # Get lung contours to speed up classification
+    lung_contours = get_lung_contours(small_img, 0.05)
+
+    # Total # of predictions on this image
+    prediction_h = (img_shape[0] // sub_h)
+    prediction_w = (img_shape[1] // sub_w)
+    prediction_n = prediction_h * prediction_w
+
+    # For knowing which classifier to use for a given input. Starts as 2d for easier reference
+    type_one_mask = np.zeros((prediction_h, prediction_w), dtype=bool)
+
+    """
+    Build this reference by rescaling our image detections to match the image's subsection grid (and 
+        casting to int), then setting all entries in our classifier reference bounded by each detection
+        to be True representing the inputs which are within detections.
+    Since this won't work and doesn't make since if we don't have any detections, we check for that 
+        also before doing this.
+    """
+    if len(detections) > 0:
+        detections = np.array(detections)
+        detections[:, 0] = detections[:, 0] / sub_w  # x1
+        detections[:, 1] = detections[:, 1] / sub_h  # y1
+        detections[:, 2] = detections[:, 2] / sub_w  # x2
+        detections[:, 3] = detections[:, 3] / sub_h  # y2
+        detections = detections.astype(np.uint16)
+        for i, detection in enumerate(detections):
+            type_one_mask[detection[1]:detection[3], detection[0]:detection[2]] = True
+
+    # Then reshape back to 1d so we can easily use it as a mask
+    type_one_mask = np.reshape(type_one_mask, (prediction_n,))
+
+    # Get indices of all entries in type_one_mask (and therefore the indices of all subsections which
+    #   are to be classified by our type-one classifier)
+    #   which are true. These are the subsections as input for the type-one classifier
+    type_one_subsection_indices = np.arange(prediction_n)[type_one_mask]
+
+    # Test each portion of the grid to see if it lies inside one of the contours
+    out_contour_mask = get_out_contour_mask(lung_contours, prediction_h, prediction_w, sub_h, sub_w)
+    out_contour_mask = np.reshape(out_contour_mask, (prediction_n,))
+    # Get indices of all entries in type_one_mask (and therefore the indices of all subsections which
+    #   are to be classified by our non-type-one classifier)
+    #   which are false. These are the subsections as input for the non-type-one classifier
+    non_type_one_subsection_indices = np.arange(prediction_n)[np.logical_not(
+        np.logical_or(type_one_mask, out_contour_mask))]
+
+    return prediction_h, prediction_w, type_one_subsection_indices, non_type_one_subsection_indices
+
+
+def get_batches(type_one_subsection_indices, non_type_one_subsection_indices, batch_sizes):
+    # Loop through subsection input indices for both models in batches, yielding (classifier, batch_indices, percent)
+    #   for each batch, where percent is how far through this image the batch is. Classifiers without a batch size
+    #   in batch_sizes are skipped.
+    subsection_n = len(type_one_subsection_indices) + len(non_type_one_subsection_indices)
+    for classifier, subsection_indices, done_n in [
+        ("type_one", type_one_subsection_indices, 0),
+        ("non_type_one", non_type_one_subsection_indices, len(type_one_subsection_indices))
+    ]:
+        if classifier not in batch_sizes:
+            continue
+        mb_n = batch_sizes[classifier]
+        for subsection_i in range(0, len(subsection_indices), mb_n):
+            yield (
+                classifier,
+                subsection_indices[subsection_i:subsection_i + mb_n],
+                ((done_n + subsection_i) / subsection_n) * 100.0
+            )
+
+
+def insert_predictions(prediction_grid, classifier, batch_indices, predictions, model):
+    # Convert the local output classification enumeration of the given classifier to the global ones and insert
+    # them into our flattened prediction grid.
+    if classifier == "type_one":
+        prediction_grid[batch_indices, 0:2] = predictions[:, 0:2]
+        prediction_grid[batch_indices, 3] = predictions[:, 2]
+        prediction_grid[batch_indices, 5] = predictions[:, 3]
+    else:
+        if model == "balbc":
+            predictions = np.insert(predictions, 1, 0, axis=1)
+        prediction_grid[batch_indices, 0] = predictions[:, 0]
+        prediction_grid[batch_indices, 2:5] = predictions[:, 1:]
+
+
+def get_batch_sizes(classifiers, classifier_fpaths, input_shape, mb_n=None, queued_batch_n=0, memory_fraction=0.25,
+                    autotune=True, runtime="keras", precision="float32", num_threads=None):
+    # Get the batch size to classify with for each of classifiers, which were loaded from classifier_fpaths with the
+    # given runtime, precision and number of threads. If mb_n is given, every classifier uses it, otherwise each gets
+    # its own from get_batch_size.
+    if mb_n is not None:
+        return {classifier: mb_n for classifier in classifiers}
+    return {
+        classifier: get_batch_size(classifiers[classifier], classifier_fpaths[classifier], input_shape,
+                                   queued_batch_n=queued_batch_n, memory_fraction=memory_fraction, autotune=autotune,
+                                   runtime=runtime, precision=precision, num_threads=num_threads)
+        for classifier in classifiers
+    }
+
+
+"""
+Worker processes for PredictionGrids.generate when generate_workers > 1. Each worker loads our classifiers once in
+    init_generate_worker, then generates and saves the prediction grids for one image at a time with generate_grid,
+    putting (img_i, percent) on the shared progress queue after each batch so generate can show our progress.
+The workers are started with the "spawn" method rather than forked, since the parent process has usually already
+    started TensorFlow (e.g. to detect type ones), and a forked copy of a started TensorFlow can't be configured.
+"""
+worker_classifiers = {}
+worker_classifier_fpaths = {}
+worker_runtime = {}  # runtime, precision and num_threads our classifiers were loaded with
+worker_progress_queue = None
+worker_init_error = None  # Error raised while initializing this worker, if any
+
+def init_generate_worker(classifier_fpaths, runtime, runtime_precision, progress_queue, intra_op_threads):
+    global worker_progress_queue, worker_init_error
+    worker_progress_queue = progress_queue
+    try:
+        import tensorflow as tf
+
+        # Split the cpus between our workers instead of each worker trying to use all of them. This has to happen
+        # before TensorFlow starts, which it hasn't yet in a newly spawned worker.
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+        for classifier, fpath in classifier_fpaths.items():
+            worker_classifiers[classifier] = load_classifier(fpath, runtime=runtime, precision=runtime_precision,
+                                                             num_threads=intra_op_threads)
+        worker_classifier_fpaths.update(classifier_fpaths)
+        worker_runtime.update(runtime=runtime, precision=runtime_precision, num_threads=intra_op_threads)
+    except Exception as e:
+        # If our initializer raised, the pool would keep replacing us with new workers which fail the same way, so
+        # we keep the error and raise it from the first task we're given instead
+        worker_init_error = e
+
+def get_worker_batch_sizes(input_shape, mb_n, queued_batch_n, memory_fraction, autotune):
+    # get_batch_sizes for the classifiers loaded in this worker, so that the parent process never has to load them
+    if worker_init_error is not None:
+        raise worker_init_error
+    return get_batch_sizes(worker_classifiers, worker_classifier_fpaths, input_shape, mb_n=mb_n,
+                           queued_batch_n=queued_batch_n, memory_fraction=memory_fraction, autotune=autotune,
+                           **worker_runtime)
+
+def denoise_grid(img_i, prediction_grid, denoising_weight, denoising_method, denoising_iterations, check_error=False):
+    # Denoise the prediction grid of image img_i with denoise_predictions. If it's approximated with the "neumann"
+    # method, we also report how far it may be from the exact solution, and if check_error, how far it actually is,
+    # which means also solving for the exact solution.
+    denoised_grid = denoise_predictions(prediction_grid, denoising_weight, method=denoising_method,
+                                        iterations=denoising_iterations)
+    if denoising_method == "neumann":
+        if check_error:
+            error, bound = get_neumann_error(prediction_grid, denoising_weight, denoising_iterations)
+            print("\nDenoised Image {} with error {:.2e} of at most {:.2e}.".format(img_i, error, bound))
+        else:
+            bound = get_neumann_error_bound(prediction_grid, denoising_weight, denoising_iterations)
+            print("\nDenoised Image {} with error of at most {:.2e}.".format(img_i, bound))
+    return denoised_grid
+
+def read_subsections(archive, indices, grid_w, sub_h, sub_w):
+    # Read the subsections with the given indices (into the archive's subsections flattened row by row, as in
+    # ImageSubsections) from the archive, as one np array. Only the rows of subsections the indices are in are read,
+    # and only between the first and last subsection needed on each, so the full image is never loaded.
+    rows = indices // grid_w
+    cols = indices % grid_w
+    subsections = None
+    for row in np.unique(rows):
+        positions = np.nonzero(rows == row)[0]
+        col1, col2 = np.min(cols[positions]), np.max(cols[positions]) + 1
+        band = archive.read_region(col1 * sub_w, row * sub_h, col2 * sub_w, (row + 1) * sub_h)
+        band_subsections = ImageSubsections(band, sub_h, sub_w)[cols[positions] - col1]
+        if subsections is None:
+            subsections = np.empty((len(indices),) + band_subsections.shape[1:], dtype=band_subsections.dtype)
+        subsections[positions] = band_subsections
+    return subsections
+
+def generate_grid(img_i, archive_fpath, detections, model, sub_h, sub_w, class_n, denoising_weight, denoising_method,
+                  denoising_iterations, check_denoising_error, batch_sizes, grid_fpaths):
+    # Generate the prediction grid for the image archived at archive_fpath, and save it to each of grid_fpaths.
+    if worker_init_error is not None:
+        raise worker_init_error
+    # Each batch of subsections is read from the archive as it's needed, instead of loading the full image, so that
+    # the memory each worker needs doesn't grow with the size of the slide
+    archive = SlideArchive(archive_fpath)
+    prediction_h, prediction_w, type_one_subsection_indices, non_type_one_subsection_indices = \
+        get_subsection_indices(archive.shape(), archive.read_resized(0.05, 0.05), detections, sub_h, sub_w)
+
+    prediction_grid = np.zeros((prediction_h * prediction_w, class_n), dtype=np.float32)
+    prediction_grid[:, 3] = 1
+    batch_sizes = {classifier: mb_n for classifier, mb_n in batch_sizes.items() if classifier in worker_classifiers}
+    for classifier, batch_indices, percent in get_batches(type_one_subsection_indices,
+                                                          non_type_one_subsection_indices, batch_sizes):
+        worker_progress_queue.put((img_i, percent))
+        batch = read_subsections(archive, batch_indices, prediction_w, sub_h, sub_w)
+        predictions = worker_classifiers[classifier].predict(batch, batch_size=len(batch))
+        insert_predictions(prediction_grid, classifier, batch_indices, predictions, model)
+
+    prediction_grid = np.reshape(prediction_grid, (prediction_h, prediction_w, class_n))
+    prediction_grid = denoise_grid(img_i, prediction_grid, denoising_weight, denoising_method, denoising_iterations,
+                                   check_error=check_denoising_error)
+    prediction_grid = np.argmax(prediction_grid, axis=2)
+    for fpath in grid_fpaths:
+        save_archive(fpath, prediction_grid)
+    return img_i
+
+
 class PredictionGrids(object):
     def __init__(self, dataset, uid, restart=False):
         self.dataset = dataset  # for reference, do not modify
@@ -56,141 +306,140 @@ class PredictionGrids(object):
         self.class_n = 7
         self.sub_h = 80
         self.sub_w = 145
-        self.mb_n = 24  # Optimal Mini batch size
+        self.mb_n = None  # Mini batch size for both classifiers. If None, each classifier gets its own from get_batch_size
+        self.autotune_batch_size = True  # If True, time each classifier to find its fastest batch size the first time
+        self.prefetch_n = 4  # Number of batches to prepare ahead of the classifiers while generating
+        self.generate_workers = 1  # Number of worker processes to generate grids with. If 1, we generate in this process
         self.denoising_weight = 0.8  # Amount to denoise, 0 <= denoising_weight <= 1. Higher means more denoising.
+        self.denoising_method = "exact"  # "exact", or "neumann" to approximate denoising faster, see post_processing
+        self.denoising_iterations = 30  # Iterations for the "neumann" denoising method
+        self.check_denoising_error = False  # If True, report the actual error of the "neumann" method, which is slow
+        self.runtime = "keras"  # "keras", or "tflite" to classify with exports of our classifiers, see inference_runtime
+        self.runtime_precision = "float32"  # Precision of the exports if using "tflite", see inference_runtime
 
         # Classifiers
         if self.dataset.progress["model"] == "kramnik":
-            # For type-one classification
-            self.type_one_classifier = load_model("../classifiers/type_one_classifier.h5")
-            # For non-type-one classification
-            self.non_type_one_classifier = load_model("../classifiers/non_type_one_classifier.h5")
+            self.classifier_fpaths = {
+                "type_one": "../classifiers/type_one_classifier.h5",  # For type-one classification
+                "non_type_one": "../classifiers/non_type_one_classifier.h5"  # For non-type-one classification
+            }
         else:
-            self.non_type_one_classifier = load_model("../classifiers/balbc_classifier.h5")
+            self.classifier_fpaths = {"non_type_one": "../classifiers/balbc_classifier.h5"}
+        self.classifiers = {}  # Loaded by load_classifiers, only when generating in this process
+
+    def load_classifiers(self):
+        # Load our classifiers into this process, unless they already are
+        if len(self.classifiers) > 0:
+            return
+        self.classifiers = {
+            classifier: load_classifier(fpath, runtime=self.runtime, precision=self.runtime_precision)
+            for classifier, fpath in self.classifier_fpaths.items()
+        }
+        self.non_type_one_classifier = self.classifiers["non_type_one"]
+        if "type_one" in self.classifiers:
+            self.type_one_classifier = self.classifiers["type_one"]
+
+    def get_batch_sizes(self):
+        # Get the batch size to classify with for each of our loaded classifiers. Each batch is classified in a single
+        # predict call, so larger batches mean fewer calls, up to what fits in memory alongside the batches waiting
+        # in our queue.
+        return get_batch_sizes(self.classifiers, self.classifier_fpaths, (self.sub_h, self.sub_w, 3), mb_n=self.mb_n,
+                               queued_batch_n=self.prefetch_n, autotune=self.autotune_batch_size,
+                               runtime=self.runtime, precision=self.runtime_precision)
+
+    def prepare_batches(self, batch_queue, batch_sizes):
+        # Producer for generate(), run on its own thread. Loads each image (prefetching the next one on another
+        # thread while we work on the current one), works out which subsections go to which classifier, and puts
+        # the batches of subsections for each image on batch_queue, so that they are ready as soon as generate()
+        # has finished classifying the previous batch. Since batch_queue is bounded, we never get more than
+        # self.prefetch_n batches ahead of the classifiers. batch_sizes gives the batch size for each classifier.
+        try:
+            with ThreadPoolExecutor(max_workers=1) as img_loader:
+                if len(self.dataset.imgs) > 0:
+                    next_img = img_loader.submit(self.dataset.imgs.__getitem__, 0)
+                for img_i in range(len(self.dataset.imgs)):
+                    img = next_img.result()
+                    if img_i + 1 < len(self.dataset.imgs):
+                        next_img = img_loader.submit(self.dataset.imgs.__getitem__, img_i + 1)
+
+                    # Get which subsections go to which classifier, getting lung contours from a low resolution
+                    # level of the image
+                    prediction_h, prediction_w, type_one_subsection_indices, non_type_one_subsection_indices = \
+                        get_subsection_indices(img.shape, self.dataset.imgs.read_resized(img_i, 0.05, 0.05),
+                                               self.dataset.type_one_detections.after_editing[img_i],
+                                               self.sub_h, self.sub_w)
+
+                    # Class to interface with the image as if it were a vector of subsections of size
+                    # self.sub_hxself.sub_w, without actually dividing the image as doing so would require too much
+                    # storage.
+                    img_subsections = ImageSubsections(img, self.sub_h, self.sub_w)
+
+                    batch_queue.put(("img", img_i, prediction_h, prediction_w))
+
+                    # Get batch inputs from the batch indices of each batch
+                    for classifier, batch_indices, percent in get_batches(type_one_subsection_indices,
+                                                                          non_type_one_subsection_indices,
+                                                                          batch_sizes):
+                        batch_queue.put(("batch", classifier, batch_indices, img_subsections[batch_indices], percent))
+
+                    batch_queue.put(("img_done", img_i))
+            batch_queue.put(("done",))
+        except Exception as e:
+            # Hand the error to generate() so it is raised on the main thread
+            batch_queue.put(("error", e))
 
     def generate(self):
         # Loops through a grid of subsections in our image as input to our models,
         # and outputs a grid of predictions matching these subsections.
+        # Images are loaded and their subsections are batched by prepare_batches() on a separate thread, so this
+        # thread only has to classify each batch as it arrives and update our progress.
+        # If self.generate_workers > 1, images are instead sharded across that many worker processes.
 
         # Generate for each image
         progress = TwoLayerProgress(
             steps=len(self.dataset.imgs),
             label="Generating Prediction Grids"
         )
-        for img_i, img in enumerate(self.dataset.imgs):
-            progress.step()
-            progress.setProgressStep(img_i)
-            progress.setProgressTwoPercent(0)
-            progress.update()
+        if self.generate_workers > 1:
+            self.generate_in_workers(progress)
+        else:
+            self.load_classifiers()
+            self.generate_in_process(progress, self.get_batch_sizes())
+        progress.destroy()
 
-            # Get lung contours to speed up classification
-            lung_contours = get_lung_contours(img)
-
-            # Total # of predictions on this image
-            prediction_h = (img.shape[0] // self.sub_h)
-            prediction_w = (img.shape[1] // self.sub_w)
-            prediction_n = prediction_h * prediction_w
-
-            # Where predictions are stored for image. Starts as 1d for easier reference
-            prediction_grid = np.zeros((prediction_n, self.class_n), dtype=np.float32)
-            prediction_grid[:, 3] = 1
-            # prediction_grid = np.full((prediction_n, self.class_n), fill_value=2, dtype=np.float32)
-
-
-            # Class to interface with the image as if it were a vector of subsections of size self.sub_hxself.sub_w,
-            # without actually dividing the image as doing so would require too much storage.
-            img_subsections = ImageSubsections(img, self.sub_h, self.sub_w)
-
-            # For knowing which classifier to use for a given input. Starts as 2d for easier reference
-            type_one_mask = np.zeros((prediction_h, prediction_w), dtype=bool)
-
-            """
-            Build this reference by rescaling our image detections to match the image's subsection grid (and casting to 
-                int), then setting all entries in our classifier reference bounded by each detection
-                to be True representing the inputs which are within detections.
-            Since this won't work and doesn't make since if we don't have any detections, we check for that also before
-                doing this.
-            """
-            detections = self.dataset.type_one_detections.after_editing[img_i]
-
-            if len(detections) > 0:
-                detections[:, 0] = detections[:, 0] / self.sub_w  # x1
-                detections[:, 1] = detections[:, 1] / self.sub_h  # y1
-                detections[:, 2] = detections[:, 2] / self.sub_w  # x2
-                detections[:, 3] = detections[:, 3] / self.sub_h  # y2
-                detections = detections.astype(np.uint16)
-                for i, detection in enumerate(detections):
-                    type_one_mask[detection[1]:detection[3], detection[0]:detection[2]] = True
-
-            # Then reshape back to 1d so we can easily use it as a mask
-            type_one_mask = np.reshape(type_one_mask, (prediction_n,))
-
-            # Get indices of all entries in type_one_mask (and therefore the indices of all subsections which are to
-            #   be classified by our type-one classifier)
-            #   which are true. These are the subsections as input for the type-one classifier
-            type_one_subsection_indices = np.arange(len(img_subsections))[type_one_mask]
-
-            out_contour_mask = np.ones((prediction_h, prediction_w), dtype=bool)
-            # Test each portion of the grid to see if it lies inside one of the contours
-            for r in range(len(out_contour_mask)):
-                for c in range(len(out_contour_mask[r])):
-                    for i, contour in enumerate(lung_contours):
-                        # Negative if outside
-                        if cv2.pointPolygonTest(contour, (c * self.sub_w, r * self.sub_h), False) > 0 or \
-                                cv2.pointPolygonTest(contour, (c * self.sub_w, r * self.sub_h + self.sub_h),
-                                                     False) > 0 or \
-                                cv2.pointPolygonTest(contour, (c * self.sub_w + self.sub_w,r * self.sub_h, ),
-                                                     False) > 0 or \
-                                cv2.pointPolygonTest(contour,
-                                                     (c * self.sub_w + self.sub_w,r * self.sub_h + self.sub_h, ),
-                                                     False) > 0:
-                            out_contour_mask[r, c] = False
-                            break
-            out_contour_mask = np.reshape(out_contour_mask, (prediction_n,))
-            # Get indices of all entries in type_one_mask (and therefore the indices of all subsections which are to
-            #   be classified by our non-type-one classifier)
-            #   which are false. These are the subsections as input for the non-type-one classifier
-            non_type_one_subsection_indices = np.arange(len(img_subsections))[np.logical_not(
-                np.ma.mask_or(type_one_mask, out_contour_mask))]
-
-            # Loop through subsection input indices for both models in batches, get the associated inputs in batches,
-            #   then classify the batches (much faster than individual classification) and store back into our prediction grid.
-            for type_one_subsection_i in range(0, len(type_one_subsection_indices), self.mb_n):
-                percent = (type_one_subsection_i / (len(non_type_one_subsection_indices) + len(
-                    type_one_subsection_indices))) * 100.0
-                sys.stdout.write(
-                    "\rGenerating Prediction Grid on Image %i/%i. %.2f%% Complete." % (
-                        img_i,
-                        len(self.dataset.imgs) - 1,
-                        percent
-                    )
-                )
-                progress.setProgressTwoPercent(percent)
-                progress.step()
-                progress.update()
+        sys.stdout.flush()
+        print("")
 
-                # Get batch indices
-                type_one_subsection_batch_indices = type_one_subsection_indices[
-                                                    type_one_subsection_i:type_one_subsection_i + self.mb_n]
+        # Now that we've finished generating, we've started editing, so we update user progress.
+        self.dataset.progress["prediction_grids_started_editing"] = True
 
-                # Get batch inputs from the batch indices
-                type_one_subsections = img_subsections[type_one_subsection_batch_indices]
+    def generate_in_process(self, progress, batch_sizes):
+        batch_queue = queue.Queue(maxsize=self.prefetch_n)
+        producer = threading.Thread(target=self.prepare_batches, args=(batch_queue, batch_sizes), daemon=True)
+        producer.start()
 
-                # Get batch outputs from the type one classifier
-                type_one_predictions = self.type_one_classifier.predict(type_one_subsections)
+        while True:
+            item = batch_queue.get()
+            if item[0] == "error":
+                progress.destroy()
+                raise item[1]
 
-                # Convert the local output classification enumeration of this classifier to the global ones and insert
-                prediction_grid[type_one_subsection_batch_indices, 0:2] = type_one_predictions[:, 0:2]
-                prediction_grid[type_one_subsection_batch_indices, 3] = type_one_predictions[:, 2]
-                prediction_grid[type_one_subsection_batch_indices, 5] = type_one_predictions[:, 3]
+            elif item[0] == "done":
+                break
+
+            elif item[0] == "img":
+                _, img_i, prediction_h, prediction_w = item
+                progress.step()
+                progress.setProgressStep(img_i)
+                progress.setProgressTwoPercent(0)
+                progress.update()
 
-            for non_type_one_subsection_i in range(0, len(non_type_one_subsection_indices), self.mb_n):
-                if not non_type_one_subsection_indices[0]:
-                    # it shouldn't be doing this if there's nothing here
-                    break
+                # Where predictions are stored for image. Starts as 1d for easier reference
+                prediction_grid = np.zeros((prediction_h * prediction_w, self.class_n), dtype=np.float32)
+                prediction_grid[:, 3] = 1
 
-                percent = ((non_type_one_subsection_i + len(type_one_subsection_indices) - 1) /
-                           (len(non_type_one_subsection_indices) + len(type_one_subsection_indices))) * 100.0
+            elif item[0] == "batch":
+                _, classifier, batch_indices, batch, percent = item
                 sys.stdout.write(
                     "\rGenerating Prediction Grid on Image %i/%i. %.2f%% Complete." % (
                         img_i,
@@ -201,37 +450,94 @@ class PredictionGrids(object):
                 progress.setProgressTwoPercent(percent)
                 progress.step()
                 progress.update()
-                # Get batch indices
-                non_type_one_subsection_batch_indices = non_type_one_subsection_indices[
-                                                        non_type_one_subsection_i:non_type_one_subsection_i + self.mb_n]
-                # Get batch inputs from the batch indices
-                non_type_one_subsections = img_subsections[non_type_one_subsection_batch_indices]
-
-                # Get batch outputs from the type one classifier
-                non_type_one_predictions = self.non_type_one_classifier.predict(non_type_one_subsections)
-                if self.dataset.progress["model"] == "balbc":
-                    non_type_one_predictions = np.insert(non_type_one_predictions, 1, 0, axis=1)
-
-
-                # Convert the local output classification enumeration of this classifier to the global ones and insert
-                prediction_grid[non_type_one_subsection_batch_indices, 0] = non_type_one_predictions[:, 0]
-                prediction_grid[non_type_one_subsection_batch_indices, 2:5] = non_type_one_predictions[:, 1:]
-
-            # Reshape prediction grid to 2d now that we have all predictions, and denoise them.
-            prediction_grid = np.reshape(prediction_grid, (prediction_h, prediction_w, self.class_n))
-            prediction_grid = denoise_predictions(prediction_grid, self.denoising_weight)
 
-            # Once denoised, save the predictions as argmaxed since we no longer need the full output
-            self.before_editing[img_i] = np.argmax(prediction_grid, axis=2)
-            self.after_editing[img_i] = np.argmax(prediction_grid, axis=2)
-
-        progress.destroy()
-
-        sys.stdout.flush()
-        print("")
+                # Classify the batch in one call (much faster than individual classification), then insert the
+                # predictions into our prediction grid.
+                predictions = self.classifiers[classifier].predict(batch, batch_size=len(batch))
+                insert_predictions(prediction_grid, classifier, batch_indices, predictions,
+                                   self.dataset.progress["model"])
+
+            elif item[0] == "img_done":
+                # Reshape prediction grid to 2d now that we have all predictions, and denoise them.
+                prediction_grid = np.reshape(prediction_grid, (prediction_h, prediction_w, self.class_n))
+                prediction_grid = denoise_grid(img_i, prediction_grid, self.denoising_weight, self.denoising_method,
+                                               self.denoising_iterations, check_error=self.check_denoising_error)
+
+                # Once denoised, save the predictions as argmaxed since we no longer need the full output
+                self.before_editing[img_i] = np.argmax(prediction_grid, axis=2)
+                self.after_editing[img_i] = np.argmax(prediction_grid, axis=2)
+
+        producer.join()
+
+    def generate_in_workers(self, progress):
+        # Shard our images across a pool of self.generate_workers worker processes, each of which loads our
+        # classifiers once, then generates and saves the grids for one image at a time. Meanwhile we show the number
+        # of finished images on the first progress bar, and the mean progress through the images still being
+        # generated on the second.
+        context = multiprocessing.get_context("spawn")
+        progress_queue = context.Queue()
+        pool = context.Pool(
+            self.generate_workers,
+            initializer=init_generate_worker,
+            initargs=(self.classifier_fpaths, self.runtime, self.runtime_precision, progress_queue,
+                      max(1, os.cpu_count() // self.generate_workers))
+        )
 
-        # Now that we've finished generating, we've started editing, so we update user progress.
-        self.dataset.progress["prediction_grids_started_editing"] = True
+        # Get our batch sizes from one of the workers, which all share the memory
+        try:
+            batch_sizes = pool.apply(get_worker_batch_sizes, ((self.sub_h, self.sub_w, 3), self.mb_n, self.prefetch_n,
+                                                              0.25 / self.generate_workers, self.autotune_batch_size))
+        except:
+            pool.terminate()
+            progress.destroy()
+            raise
+        results = [
+            pool.apply_async(generate_grid, (
+                img_i,
+                self.dataset.imgs.archives[img_i],
+                self.dataset.type_one_detections.after_editing[img_i],
+                self.dataset.progress["model"],
+                self.sub_h,
+                self.sub_w,
+                self.class_n,
+                self.denoising_weight,
+                self.denoising_method,
+                self.denoising_iterations,
+                self.check_denoising_error,
+                batch_sizes,
+                [self.before_editing.archives[img_i], self.after_editing.archives[img_i]]
+            ))
+            for img_i in range(len(self.dataset.imgs))
+        ]
+        pool.close()
+
+        img_percents = {}  # Latest progress through each image that has started
+        done_n = 0
+        while done_n < len(results):
+            # Wait briefly for progress from the workers, then take all of it that has arrived
+            try:
+                img_i, percent = progress_queue.get(timeout=0.1)
+                while True:
+                    img_percents[img_i] = percent
+                    img_i, percent = progress_queue.get_nowait()
+            except queue.Empty:
+                pass
+
+            for result in results:
+                if result.ready() and not result.successful():
+                    pool.terminate()
+                    progress.destroy()
+                    result.get()  # Raises the worker's error
+
+            done_n = sum(result.ready() for result in results)
+            percents = [percent for img_i, percent in img_percents.items() if not results[img_i].ready()]
+            percent = np.mean(percents) if len(percents) > 0 else 0
+            sys.stdout.write("\rGenerating Prediction Grids. %i/%i Images Complete." % (done_n, len(results)))
+            progress.setProgressStep(done_n)
+            progress.setProgressTwoPercent(percent)
+            progress.step()
+            progress.update()
+        pool.join()
 
     def edit(self):
         # Displays predictions on all images and allows the user to edit them until they are finished. The editor handles the saving of edits.
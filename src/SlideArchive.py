@@ -0,0 +1,274 @@
+import os
+
+import cv2
+import h5py
+import numpy as np
+
+
+def get_level_n(shape, level_downsample, min_level_size, max_downsample):
+    # Number of pyramid levels for a slide of the given shape. We keep adding levels (each downsampled by
+    # level_downsample from the last) until the longest side of the next level would be smaller than min_level_size,
+    # or until the downsample factor would exceed max_downsample.
+    level_n = 1
+    while max(shape[0], shape[1]) // (level_downsample ** level_n) >= min_level_size and \
+            level_downsample ** level_n <= max_downsample:
+        level_n += 1
+    return level_n
+
+
+def get_level_shape(shape, downsample):
+    # Shape of a level downsampled by downsample from the full resolution shape. We round up so that every
+    # full resolution pixel is represented at every level.
+    return (-(-shape[0] // downsample), -(-shape[1] // downsample)) + tuple(shape[2:])
+
+
+class SlideArchiveWriter(object):
+    """
+    Allocates every level of a new SlideArchive for a slide of the given shape, then accepts the full resolution
+        slide one tile at a time, writing each tile into level 0 and a downsampled copy of it into every other level.
+        This way we never need more than one tile of the slide in memory at once.
+
+    Tiles must be written with their top-left corner at a multiple of SlideArchive.write_tile_size.
+    """
+    def __init__(self, fpath, shape, dtype=np.uint8):
+        self.fpath = fpath
+        self.shape = tuple(shape)
+        self.level_n = get_level_n(self.shape, SlideArchive.level_downsample, SlideArchive.min_level_size,
+                                   SlideArchive.write_tile_size)
+        self.file = h5py.File(self.fpath, 'w')
+        self.file.attrs["level_downsample"] = SlideArchive.level_downsample
+        self.file.attrs["level_n"] = self.level_n
+        for level in range(self.level_n):
+            level_shape = get_level_shape(self.shape, SlideArchive.level_downsample ** level)
+            chunks = (min(SlideArchive.chunk_size, level_shape[0]),
+                      min(SlideArchive.chunk_size, level_shape[1])) + level_shape[2:]
+            self.file.create_dataset(str(level), shape=level_shape, dtype=dtype, chunks=chunks, compression="lzf")
+
+    def write_tile(self, x, y, tile):
+        # Write the full resolution tile with top-left corner (x, y) into every level.
+        tile_h, tile_w = tile.shape[:2]
+        for level in range(self.level_n):
+            downsample = SlideArchive.level_downsample ** level
+            level_data = self.file[str(level)]
+
+            # Get this tile's location on this level, rounding the bottom-right corner up to match get_level_shape
+            level_x1 = x // downsample
+            level_y1 = y // downsample
+            level_x2 = min(-(-(x + tile_w) // downsample), level_data.shape[1])
+            level_y2 = min(-(-(y + tile_h) // downsample), level_data.shape[0])
+            if downsample == 1:
+                level_tile = tile
+            else:
+                level_tile = cv2.resize(tile, (level_x2 - level_x1, level_y2 - level_y1), interpolation=cv2.INTER_AREA)
+                level_tile = np.reshape(level_tile, (level_y2 - level_y1, level_x2 - level_x1) + tile.shape[2:])
+            level_data[level_y1:level_y2, level_x1:level_x2] = level_tile
+
+    def write(self, img):
+        # Write an entire full resolution image, tile by tile.
+        for y in range(0, img.shape[0], SlideArchive.write_tile_size):
+            for x in range(0, img.shape[1], SlideArchive.write_tile_size):
+                self.write_tile(x, y, img[y:y + SlideArchive.write_tile_size, x:x + SlideArchive.write_tile_size])
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class SlideView(object):
+    """
+    Read-only, array-like view of one level of a SlideArchive. Slicing it, e.g. view[y1:y2, x1:x2], reads only
+        the tiles of the archive under the slice and returns them as a new np array, so the rest of the slide is
+        never loaded into memory. Writes have to go through SlideArchive.write instead.
+    """
+    def __init__(self, archive, level=0):
+        self.archive = archive
+        self.level = level
+        with h5py.File(self.archive.fpath, 'r') as f:
+            self.shape = f[str(self.level)].shape
+            self.dtype = f[str(self.level)].dtype
+        self.ndim = len(self.shape)
+
+    def __getitem__(self, key):
+        with h5py.File(self.archive.fpath, 'r') as f:
+            return f[str(self.level)][key]
+
+    def __array__(self, dtype=None):
+        img = self.archive.read_level(self.level)
+        return img if dtype is None else img.astype(dtype)
+
+    def __len__(self):
+        return self.shape[0]
+
+
+class ResizedSlideView(object):
+    """
+    Read-only, array-like view of a SlideArchive resized by fx and fy, the same as SlideArchive.read_resized(fx, fy).
+        Slicing it, e.g. view[y1:y2, x1:x2], resizes only the region of the lowest resolution level under the slice,
+        so memory use depends on the size of the slice rather than the size of the slide. Only 2d slices without a
+        step are supported.
+    """
+    def __init__(self, archive, fx, fy, interpolation=cv2.INTER_LINEAR):
+        self.archive = archive
+        self.level = self.archive.best_level(max(fx, fy))
+        self.interpolation = interpolation
+        h, w = self.archive.shape()[:2]
+        self.dsize = (int(round(w * fx)), int(round(h * fy)))
+        self.shape = (self.dsize[1], self.dsize[0]) + tuple(self.archive.shape()[2:])
+        self.dtype = self.archive.view(self.level).dtype
+        self.ndim = len(self.shape)
+
+    def __getitem__(self, key):
+        y1, y2, _ = key[0].indices(self.shape[0])
+        x1, x2, _ = key[1].indices(self.shape[1])
+        if y2 <= y1 or x2 <= x1:
+            return np.zeros((max(y2 - y1, 0), max(x2 - x1, 0)) + self.shape[2:], dtype=self.dtype)
+        return self.archive.read_resized_region(x1, y1, x2, y2, self.dsize, interpolation=self.interpolation,
+                                                level=self.level)
+
+    def __len__(self):
+        return self.shape[0]
+
+
+class SlideArchive(object):
+    """
+    Interface for a single slide stored on disk as a tiled, multi-resolution pyramid in one HDF5 container.
+        Level 0 is the full resolution slide, and each level after it is downsampled by level_downsample from the
+        level before it. Every level is stored in chunk_size x chunk_size tiles, so reading a region or a low
+        resolution level only reads the tiles it needs from disk instead of the entire slide.
+
+    For sessions archived before this format existed, fpath may also be a single-level .npy archive.
+    """
+    level_downsample = 4  # Downsample factor between consecutive levels
+    chunk_size = 256  # Height and width of each tile stored on disk
+    write_tile_size = 4096  # Height and width of each tile written at once, must be a power of level_downsample
+    min_level_size = 512  # Minimum length of the longest side of each level
+
+    def __init__(self, fpath):
+        self.fpath = fpath
+
+    def is_legacy(self):
+        return self.fpath.endswith(".npy")
+
+    def level_n(self):
+        if self.is_legacy():
+            return 1
+        with h5py.File(self.fpath, 'r') as f:
+            return int(f.attrs["level_n"])
+
+    def downsample(self, level):
+        return self.level_downsample ** level
+
+    def shape(self, level=0):
+        if self.is_legacy():
+            return get_level_shape(np.load(self.fpath, mmap_mode='r').shape, self.downsample(level))
+        with h5py.File(self.fpath, 'r') as f:
+            return f[str(level)].shape
+
+    def best_level(self, scale):
+        # Get the lowest resolution level which still has at least the resolution of the full resolution slide
+        # resized by scale, so that resizing it to that scale never upsamples.
+        level = 0
+        level_n = self.level_n()
+        while level + 1 < level_n and self.downsample(level + 1) <= 1. / scale:
+            level += 1
+        return level
+
+    def read_region(self, x1, y1, x2, y2, level=0):
+        # Read the region with the given full resolution coordinates from the given level.
+        downsample = self.downsample(level)
+        x1, y1 = int(x1) // downsample, int(y1) // downsample
+        x2, y2 = -(-int(x2) // downsample), -(-int(y2) // downsample)
+        if self.is_legacy():
+            return np.array(np.load(self.fpath, mmap_mode='r')[y1:y2, x1:x2])
+        with h5py.File(self.fpath, 'r') as f:
+            return f[str(level)][y1:y2, x1:x2]
+
+    def read_level(self, level=0):
+        if self.is_legacy():
+            img = np.load(self.fpath)
+            if level > 0:
+                h, w = get_level_shape(img.shape, self.downsample(level))[:2]
+                img = cv2.resize(img, (w, h), interpolation=cv2.INTER_AREA)
+            return img
+        with h5py.File(self.fpath, 'r') as f:
+            return f[str(level)][()]
+
+    def view(self, level=0):
+        # Get a read-only view of the given level which only reads the regions it is sliced with. Legacy .npy
+        # archives are memory-mapped instead, which gives the same behavior.
+        if self.is_legacy():
+            return np.load(self.fpath, mmap_mode='r')
+        return SlideView(self, level)
+
+    def resized_view(self, fx, fy, interpolation=cv2.INTER_LINEAR):
+        # Get a read-only view of the slide resized by fx and fy which only resizes the regions it is sliced with.
+        return ResizedSlideView(self, fx, fy, interpolation=interpolation)
+
+    def read_resized(self, fx, fy, interpolation=cv2.INTER_LINEAR):
+        # Get the full resolution slide resized by fx and fy, the same as cv2.resize(img, (0, 0), fx=fx, fy=fy),
+        # but resized from the lowest resolution level we can use instead of from the full resolution slide.
+        h, w = self.shape()[:2]
+        dsize = (int(round(w * fx)), int(round(h * fy)))
+        img = self.read_level(self.best_level(max(fx, fy)))
+        if img.shape[1] == dsize[0] and img.shape[0] == dsize[1]:
+            return img
+        return cv2.resize(img, dsize, interpolation=interpolation)
+
+    def write(self, img):
+        if self.is_legacy():
+            np.save(self.fpath, img)
+            return
+        with SlideArchiveWriter(self.fpath, img.shape, dtype=img.dtype) as writer:
+            writer.write(img)
+
+    def resize(self, dsize, interpolation=cv2.INTER_CUBIC, strip_h=512):
+        # Resize the full resolution slide to dsize = (width, height), the same as
+        # self.write(cv2.resize(self.read_level(0), dsize, interpolation=interpolation)). Each tile of the resized
+        # slide is built in strips of strip_h rows, each sampled from only the region of the slide under it, and
+        # written into a new archive which then replaces this one, so the slide is never entirely in memory.
+        if self.is_legacy():
+            self.write(cv2.resize(self.read_level(0), dsize, interpolation=interpolation))
+            return
+        shape = self.shape()
+        with h5py.File(self.fpath, 'r') as f:
+            dtype = f["0"].dtype
+        dst_w, dst_h = dsize
+        tmp_fpath = self.fpath + ".tmp"
+        with SlideArchiveWriter(tmp_fpath, (dst_h, dst_w) + tuple(shape[2:]), dtype=dtype) as writer:
+            for y in range(0, dst_h, self.write_tile_size):
+                for x in range(0, dst_w, self.write_tile_size):
+                    x2, y2 = min(x + self.write_tile_size, dst_w), min(y + self.write_tile_size, dst_h)
+                    tile = np.concatenate([
+                        self.read_resized_region(x, strip_y, x2, min(strip_y + strip_h, y2), dsize, interpolation)
+                        for strip_y in range(y, y2, strip_h)
+                    ])
+                    writer.write_tile(x, y, tile)
+        os.replace(tmp_fpath, self.fpath)
+
+    def read_resized_region(self, x1, y1, x2, y2, dsize, interpolation=cv2.INTER_CUBIC, level=0):
+        # Read the region y1:y2, x1:x2 of the given level resized to dsize = (width, height), the same as
+        # cv2.resize would give it, but reading only the region of the level the region is sampled from.
+        downsample = self.downsample(level)
+        h, w = self.shape(level)[:2]
+        scale_x, scale_y = w / dsize[0], h / dsize[1]
+
+        # cv2.resize samples each resized pixel from the slide at the center of the area it covers, so we read the
+        # region around those samples, with a margin for the interpolation, and sample it the same way with remap
+        src_xs = (np.arange(x1, x2) + 0.5) * scale_x - 0.5
+        src_ys = (np.arange(y1, y2) + 0.5) * scale_y - 0.5
+        margin = 4
+        src_x1 = max(int(np.floor(src_xs[0])) - margin, 0)
+        src_y1 = max(int(np.floor(src_ys[0])) - margin, 0)
+        src_x2 = min(int(np.ceil(src_xs[-1])) + margin + 1, w)
+        src_y2 = min(int(np.ceil(src_ys[-1])) + margin + 1, h)
+        region = self.read_region(src_x1 * downsample, src_y1 * downsample, src_x2 * downsample, src_y2 * downsample,
+                                  level=level)
+        map_x = np.tile((src_xs - src_x1).astype(np.float32), (len(src_ys), 1))
+        map_y = np.tile((src_ys - src_y1).astype(np.float32)[:, None], (1, len(src_xs)))
+        resized_region = cv2.remap(region, map_x, map_y, interpolation, borderMode=cv2.BORDER_REPLICATE)
+        return np.reshape(resized_region, (y2 - y1, x2 - x1) + region.shape[2:])
@@ -6,6 +6,7 @@ from tkinter import messagebox
 from PIL import ImageTk, Image
 
 from gui_base import *
+from tiled_canvas import TiledCanvasImage
 
 
 def q_key_press(event=None):
@@ -52,6 +53,8 @@ class TypeOneDetectionEditor(object):
                 0] * self.editor_resize_factor),
             cursor="crosshair"
         )
+        # Only the tiles of the image in view are rendered and kept by Tk, rather than a bitmap of the entire image
+        self.canvas_tiles = TiledCanvasImage(self.canvas, self.render_img_section)
 
         # Scrollbars
         hbar = Scrollbar(self.frame, orient=HORIZONTAL)
@@ -83,17 +86,11 @@ class TypeOneDetectionEditor(object):
         if len(self.dataset.imgs) > 1 and self.dataset.progress["type_ones_image"] > 0:
             self.leftButton.pack(side=LEFT)
 
-        self.canvas.config(xscrollcommand=hbar.set, yscrollcommand=vbar.set)
+        self.canvas.config(xscrollcommand=self.canvas_tiles.scroll_command(hbar),
+                           yscrollcommand=self.canvas_tiles.scroll_command(vbar))
 
         # Img + Event listeners
-        self.canvas.image = ImageTk.PhotoImage(
-            Image.fromarray(self.img))  # Literally because tkinter can't handle references properly and needs this.
-        self.canvas.config(scrollregion=(0, 0, self.canvas.image.width(), self.canvas.image.height()))
-        self.canvas_image_config = self.canvas.create_image(
-            0, 0,
-            image=self.canvas.image,
-            anchor="nw"
-        )  # So we can change the image later
+        self.canvas_tiles.reset(self.img.shape[1], self.img.shape[0])
         self.canvas.focus_set()
         self.canvas.bind("<Button 1>", self.mouse_click)  # left
         self.canvas.bind("<Button 3>", self.mouse_click)  # right
@@ -239,16 +236,12 @@ class TypeOneDetectionEditor(object):
     def update_img(self):
         self.reload_img_and_detections()
 
-        # Reload image displayed on canvas and detections displayed on canvas with self.img and self.detections
-        self.canvas.image = ImageTk.PhotoImage(
-            Image.fromarray(self.img))  # Literally because tkinter can't handle references properly and needs this.
-        self.canvas.itemconfig(self.canvas_image_config, image=self.canvas.image)
+        # Reload image displayed on canvas and detections displayed on canvas with self.img and self.detections,
+        # from the image's top-left corner
+        self.canvas_tiles.reset(self.img.shape[1], self.img.shape[0])
         self.canvas.delete("selection")
         self.canvas.delete("detection")
         self.update_detections()
-        self.canvas.config(scrollregion=(0, 0, self.canvas.image.width(), self.canvas.image.height()))
-        self.canvas.yview_moveto(0)
-        self.canvas.xview_moveto(0)
 
     def left_arrow_key_press(self, event=None):
         # Move to the image with index i-1, unless i = 0, in which case we do nothing. AKA the previous image.
@@ -306,11 +299,16 @@ class TypeOneDetectionEditor(object):
         self.dataset.type_one_detections.after_editing[self.dataset.progress["type_ones_image"]] = (
                     np.array(self.detections) / self.editor_resize_factor).astype(int)
 
+    def render_img_section(self, x1, y1, x2, y2):
+        # Get the section y1:y2, x1:x2 of our image for display
+        return cv2.cvtColor(np.array(self.img[y1:y2, x1:x2]),
+                            cv2.COLOR_BGR2RGB)  # We need to convert so it will display the proper colors
+
     def reload_img_and_detections(self):
         # Updates the self.img and self.detections attributes.
-        self.img = cv2.resize(self.dataset.imgs[self.dataset.progress["type_ones_image"]], (0, 0),
-                              fx=self.editor_resize_factor,
-                              fy=self.editor_resize_factor)
-        self.img = cv2.cvtColor(self.img, cv2.COLOR_BGR2RGB)  # We need to convert so it will display the proper colors
+        # Map the rendition of this image saved at our resize factor, instead of resizing the image every time.
+        # Only the sections of it in view are read, by render_img_section.
+        self.img = self.dataset.imgs.read_editor_img(self.dataset.progress["type_ones_image"],
+                                                     self.editor_resize_factor)
         self.detections = list(self.dataset.type_one_detections.after_editing[self.dataset.progress[
             "type_ones_image"]] * self.editor_resize_factor)  # Make list so we can append
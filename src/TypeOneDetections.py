@@ -1,13 +1,13 @@
 import sys, time
 import cv2, h5py
 import numpy as np
-from keras.models import load_model
 
 from base import *
 from gui_base import get_outline_rectangle_coordinates
 from EditingDataset import EditingDataset
 from TypeOneDetectionEditor import TypeOneDetectionEditor
 from ProgressBar import ProgressRoot
+from inference_runtime import load_classifier
 
 from keras_retinanet.utils.image import read_image_bgr, preprocess_image, resize_image
 from keras_retinanet import models
@@ -30,6 +30,8 @@ class TypeOneDetections(object):
                                             restart=self.restart)
 
         self.model = None
+        self.runtime = "keras"  # "keras", or "tflite" to detect with an export of our detector, see inference_runtime
+        self.runtime_precision = "float32"  # Precision of the export if using "tflite", see inference_runtime
 
         # Detection parameters and classifier
         self.detection = True
@@ -69,15 +71,19 @@ class TypeOneDetections(object):
         dist = lambda a, b: abs(a - b)
 
         if self.detection:
-            self.model = models.load_model('../classifiers/type_one_detection_classifier_resnet50.h5',
-                                           backbone_name='resnet50')
-            self.model = models.convert_model(self.model)
+            detector_fpath = '../classifiers/type_one_detection_classifier_resnet50.h5'
+            self.model = load_classifier(
+                detector_fpath,
+                runtime=self.runtime,
+                precision=self.runtime_precision,
+                load_keras_model=lambda: models.convert_model(models.load_model(detector_fpath,
+                                                                                backbone_name='resnet50'))
+            )
 
 
         # Generate for each image
         def generate_callback(index):
             img_i = index
-            img = self.imgs[img_i]
             # Progress indicator
             sys.stdout.write("\rGenerating Type One Detections on Image {}/{}...".format(img_i, len(self.imgs) - 1))
 
@@ -85,7 +91,8 @@ class TypeOneDetections(object):
             detections = []
 
             if self.detection:
-                imscan = cv2.resize(img, (0, 0), fx=0.025, fy=0.025)
+                # Only read the low resolution level we need instead of the full resolution image
+                imscan = self.imgs.read_resized(img_i, 0.025, 0.025)
                 imscan = cv2.cvtColor(imscan, cv2.COLOR_RGB2BGR)
                 imscan = preprocess_image(imscan.copy())
                 imscan, scale = resize_image(imscan)
@@ -0,0 +1,144 @@
+"""
+Helpers for archiving input images into SlideArchives.
+
+archive_src_img is run in worker processes by Images, so nothing in this file may use tkinter.
+"""
+import os
+import cv2
+import numpy as np
+import openslide
+import PIL.Image
+PIL.Image.MAX_IMAGE_PIXELS = 2000000000
+import czifile as czf
+from keras_retinanet.utils.image import read_image_bgr
+
+from SlideArchive import SlideArchive, SlideArchiveWriter
+
+openslide_image_types = {".svs", ".tif", ".vms", ".vmu", ".ndpi", ".scn",
+                         ".mrxs", ".tiff", ".svslide"}
+
+editor_resize_factor = 0.1  # Resize factor of the rendition saved for TypeOneDetectionEditor to display
+
+def archive_openslide_img(img_file, dst_fpath, thumb_fpath, editor_fpath):
+    """
+    Opens img_file with openslide and streams it into a new tiled,
+    multi-resolution archive at dst_fpath one tile at a time, so that
+    the full slide is never held in memory. Also writes a 280x280
+    thumbnail of it to thumb_fpath, and its editor rendition to
+    editor_fpath.
+    Args:
+            img_file : File name
+           dst_fpath : File name for the archive
+         thumb_fpath : File name for the thumbnail
+        editor_fpath : File name for the editor rendition
+    """
+    img = openslide.open_slide(img_file)
+    w_rec, h_rec = img.dimensions
+    tile_size = SlideArchive.write_tile_size
+    with SlideArchiveWriter(dst_fpath, (h_rec, w_rec, 3)) as writer:
+        for y in range(0, h_rec, tile_size):
+            for x in range(0, w_rec, tile_size):
+                tile = img.read_region((x, y), 0, (min(tile_size, w_rec - x), min(tile_size, h_rec - y)))
+                writer.write_tile(x, y, np.array(tile.convert('RGB')))
+    img.close()
+    save_thumbnail(SlideArchive(dst_fpath), thumb_fpath)
+    save_editor_img(SlideArchive(dst_fpath), editor_fpath)
+
+def archive_img(img, dst_fpath, thumb_fpath, editor_fpath):
+    """
+    Writes img to a new tiled, multi-resolution archive at dst_fpath,
+    a 280x280 thumbnail of it to thumb_fpath, and its editor rendition
+    to editor_fpath.
+    Args:
+                img : Full resolution image as a np array
+          dst_fpath : File name for the archive
+        thumb_fpath : File name for the thumbnail
+       editor_fpath : File name for the editor rendition
+    """
+    archive = SlideArchive(dst_fpath)
+    archive.write(img)
+    save_thumbnail(archive, thumb_fpath)
+    save_editor_img(archive, editor_fpath)
+
+def save_thumbnail(archive, thumb_fpath):
+    # Save a 280x280 thumbnail of the given SlideArchive, resized from its lowest resolution level.
+    img = archive.read_level(archive.level_n() - 1)
+    thumbnail = cv2.resize(img, (0, 0),
+                           fx=280 / img.shape[1],
+                           fy=280 / img.shape[0])
+    np.save(thumb_fpath, thumbnail)
+
+def save_editor_img(archive, editor_fpath, resize_factor=editor_resize_factor, strip_h=512):
+    # Save the given SlideArchive resized by resize_factor, so that the editors can display it without resizing it
+    # from the archive every time they switch to it. It's resized exactly as SlideArchive.read_resized would, in
+    # strips of strip_h rows written straight into the .npy file, so it's never entirely in memory.
+    resized_view = archive.resized_view(resize_factor, resize_factor)
+    tmp_fpath = editor_fpath + ".tmp"
+    editor_img = np.lib.format.open_memmap(tmp_fpath, mode='w+', dtype=resized_view.dtype, shape=resized_view.shape)
+    for y in range(0, resized_view.shape[0], strip_h):
+        editor_img[y:y + strip_h] = resized_view[y:y + strip_h, 0:resized_view.shape[1]]
+    editor_img.flush()
+    del editor_img  # Closes the memory map, so the file can be replaced
+    os.replace(tmp_fpath, editor_fpath)
+
+def archive_src_img(src_fpath, dst_prefix):
+    """
+    Archives the image at src_fpath into one or more archives named
+    dst_prefix followed by an enumeration, e.g. "{dst_prefix}0.h5" and
+    "{dst_prefix}0_thumbnail.npy" and "{dst_prefix}0_editor.npy".
+    Multi-scene .czi images get one
+    archive per scene.
+    Args:
+           src_fpath : File name of the input image
+          dst_prefix : Prefix for the file names of the archives
+    Output:
+            Returns (archived, error), where archived is a list of
+            (dst_fpath, thumb_fpath, editor_fpath, name) tuples for every
+            archive created,
+            in order, and error is None or a message to show the user.
+    """
+    fname = os.path.basename(src_fpath)
+    if not os.path.exists(src_fpath):
+        return [], "Error opening {}: {} does not exist.".format(fname, fname)
+
+    archived = []
+    _, src_suffix = os.path.splitext(src_fpath)
+    get_fpaths = lambda k: ("{}{}.h5".format(dst_prefix, k), "{}{}_thumbnail.npy".format(dst_prefix, k),
+                            "{}{}_editor.npy".format(dst_prefix, k))
+    if src_suffix in openslide_image_types:
+        dst_fpath, thumb_fpath, editor_fpath = get_fpaths(0)
+        try:
+            archive_openslide_img(src_fpath, dst_fpath, thumb_fpath, editor_fpath)
+        except:
+            return [], "Error opening {}: {} is not a valid file.".format(fname, fname)
+        archived.append((dst_fpath, thumb_fpath, editor_fpath, fname))
+    elif src_suffix == '.vsi':
+        # These should be converted to png before the code gets here
+        pass
+    elif src_suffix == '.czi':
+        try:
+            image = czf.imread(src_fpath)
+        except ValueError:
+            return [], "Error opening {}: {} is not a valid file.".format(fname, fname)
+        count = image.shape[0] * image.shape[1] * image.shape[2]
+        for i in range(image.shape[0]):
+            for j in range(image.shape[1]):
+                for k in range(image.shape[2]):
+                    dst_fpath, thumb_fpath, editor_fpath = get_fpaths(len(archived))
+                    archive_img(np.array(image[i, j, k]), dst_fpath, thumb_fpath, editor_fpath)
+                    if count > 1:
+                        name = "{} ({})".format(fname, i * image.shape[1] * image.shape[2] + j * image.shape[2] + k + 1)
+                    else:
+                        name = fname
+                    archived.append((dst_fpath, thumb_fpath, editor_fpath, name))
+    else:  # Primarily png and other images readable by numpy
+        try:
+            img_npy = read_image_bgr(src_fpath)
+        except cv2.error as e:
+            return [], "Error opening {}. {}file.".format(fname, e)
+        if img_npy is None:
+            return [], "Error opening {}. {} is not a valid file.".format(fname, fname)
+        dst_fpath, thumb_fpath, editor_fpath = get_fpaths(0)
+        archive_img(img_npy, dst_fpath, thumb_fpath, editor_fpath)
+        archived.append((dst_fpath, thumb_fpath, editor_fpath, fname))
+    return archived, None
@@ -34,30 +34,47 @@ def rects_connected(rect1, rect2):
             ((rect1_x2 >= rect2_x1 and rect1_x2 <= rect2_x2) and (rect1_y2 >= rect2_y1 and rect1_y2 <= rect2_y2))
 
 def get_rect_clusters(rects):
-    sys.setrecursionlimit(16000)
     #Get all rect clusters as a list of clusters, where each cluster is a list of rects in the cluster.
-    connected = set()#For reference and avoiding infinite recursion
-    clusters = []
-    for rect in rects:
-        if str(rect) not in connected:#if rect not part of a cluster yet
-            clusters.append(get_rect_cluster(rect, rects, connected))#add this rect's cluster to list of clusters
-    return clusters
-    
-def get_rect_cluster(rect, rects, connected):
-    #Recursive function used by get_rect_clusters. Gets a cluster of rects from the given rect.
+    #Two rects are in the same cluster if they are connected (by rects_connected, in either order), 
+    #or are both in the same cluster as another rect.
+    rects = list(rects)
+    if len(rects) == 0:
+        return []
+
+    #Instead of comparing every rect to every other, we hash each rect into every cell it touches on a grid
+    #of cells about the size of our rects. Connected rects always touch a common cell, so we only have to compare
+    #rects which share a cell, then join the clusters of each connected pair with union-find.
+    coords = np.array([rect[:4] for rect in rects], dtype=np.float64)
+    cell_size = max(np.median(coords[:, 2] - coords[:, 0]), np.median(coords[:, 3] - coords[:, 1]), 1)
+    cells = coords // cell_size
+    grid = {}
+    for i, (cell_x1, cell_y1, cell_x2, cell_y2) in enumerate(cells.astype(np.int64)):
+        for cell_y in range(cell_y1, cell_y2 + 1):
+            for cell_x in range(cell_x1, cell_x2 + 1):
+                grid.setdefault((cell_y, cell_x), []).append(i)
 
-    #Resulting list of rects for our cluster
-    cluster = [rect]
+    #parents[i] is the parent of rect i in its cluster's tree, and the root of each tree represents its cluster
+    parents = list(range(len(rects)))
+    def find(i):
+        root = i
+        while parents[root] != root:
+            root = parents[root]
+        while parents[i] != root:#Point everything on the path at the root so later finds are faster
+            parents[i], i = root, parents[i]
+        return root
 
-    #After this function our rect will be done.
-    connected.add(str(rect))#str() in order to hash our list
+    for cell_rects in grid.values():
+        for a_i, a in enumerate(cell_rects):
+            for b in cell_rects[a_i + 1:]:
+                a_root, b_root = find(a), find(b)
+                if a_root != b_root and (rects_connected(coords[a], coords[b]) or rects_connected(coords[b], coords[a])):
+                    parents[b_root] = a_root
 
-    for candidate_rect in rects:
-        if str(candidate_rect) not in connected:#Rects that are not part of a cluster yet 
-            if rects_connected(rect, candidate_rect):#These two rects are connected
-                cluster.append(candidate_rect)
-                cluster.extend(get_rect_cluster(candidate_rect, rects, connected))#Extend this cluster to include all subclusters of this candidate rect
-    return cluster
+    #Group rects by the root of their cluster, in order of each cluster's first rect
+    clusters = {}
+    for i, rect in enumerate(rects):
+        clusters.setdefault(find(i), []).append(rect)
+    return list(clusters.values())
 
 def windows(img, step_size, win_shape):
     #Yields windows of shape win_shape across our img, in steps step_size. Just uses img for the shape.
@@ -70,6 +87,96 @@ def weighted_overlay(img, overlay, alpha):
     #Overlays our overlay onto our img with alpha transparency, and returns the resulting combined img
     return cv2.addWeighted(overlay.astype(np.uint8), alpha, img, 1-alpha, 0)
 
+def get_prediction_overlay(prediction_grid, color_key, sub_h, sub_w, shape=None):
+    """
+    Arguments:
+        prediction_grid: 2d array of argmaxed predictions, or a section of one
+        color_key: Color to draw each classification with, e.g. [(255, 0, 255), (0, 0, 255), ...]
+        sub_h, sub_w: Size of the rectangle to draw each prediction as
+        shape: Shape of the image (or image section) the overlay is for. Defaults to the size of the grid of rectangles.
+
+    Returns:
+        An overlay of the given shape with each prediction drawn as a sub_hxsub_w rectangle of its color,
+            the same as drawing each one with cv2.rectangle(overlay, (col_i*sub_w, row_i*sub_h),
+            (col_i*sub_w+sub_w, row_i*sub_h+sub_h), color, -1) on an empty overlay,
+            but built with a color lookup and a block upscale instead of a rectangle for every prediction.
+    """
+    grid_h, grid_w = prediction_grid.shape[:2]
+    if shape is None:
+        shape = (grid_h*sub_h, grid_w*sub_w, len(color_key[0]))
+    overlay = np.zeros(tuple(shape[:2]) + (len(color_key[0]),), dtype=np.uint8)
+
+    # Only the rows and columns of rectangles which start inside the overlay are drawn
+    grid_h = min(grid_h, -(-shape[0] // sub_h))
+    grid_w = min(grid_w, -(-shape[1] // sub_w))
+    if grid_h == 0 or grid_w == 0:
+        return overlay
+
+    # Look up the color of each prediction and repeat each one sub_w times along its row, then write each row of
+    # these sub_h times into the overlay, through a view of the overlay split into rows of rectangles.
+    row_colors = np.repeat(np.array(color_key, dtype=np.uint8)[prediction_grid[:grid_h, :grid_w]], sub_w, axis=1)
+    h = min(shape[0], grid_h*sub_h)
+    w = min(shape[1], grid_w*sub_w)
+    full_h = h - h % sub_h
+    overlay[:full_h, :w].reshape(full_h // sub_h, sub_h, w, overlay.shape[2])[:] = row_colors[:full_h // sub_h, None, :w]
+    if full_h < h:
+        overlay[full_h:h, :w] = row_colors[full_h // sub_h, :w]
+
+    # Since cv2.rectangle includes the bottom-right corner, the row and column just past the grid get the color of
+    # the last row and column.
+    overlay[h:h + 1, :w] = overlay[h - 1, :w]
+    overlay[:h + 1, w:w + 1] = overlay[:h + 1, w - 1:w]
+    return overlay
+
+def flood_fill(grid, x, y, value):
+    """
+    Arguments:
+        grid: 2d array of classifications, e.g. a prediction grid, which is filled in place
+        x, y: Cell to start filling from
+        value: Classification to fill with
+
+    Returns:
+        The bounding box (x1, y1, x2, y2) of the cells filled, i.e. every cell with the same classification as
+            (x, y) which is 4-connected to it, or None if nothing changed.
+    """
+    if grid[y, x] == value:
+        return None
+
+    # cv2.floodFill finds the connected cells and their bounding box for us, marking the cells in a mask which is
+    # one cell larger than the grid on every side
+    mask = np.zeros((grid.shape[0] + 2, grid.shape[1] + 2), dtype=np.uint8)
+    _, _, _, (rect_x, rect_y, rect_w, rect_h) = cv2.floodFill(
+        grid.astype(np.uint8), mask, (int(x), int(y)), 0, loDiff=0, upDiff=0,
+        flags=4 | cv2.FLOODFILL_MASK_ONLY | (1 << 8))
+    x1, y1, x2, y2 = rect_x, rect_y, rect_x + rect_w, rect_y + rect_h
+    filled = mask[y1 + 1:y2 + 1, x1 + 1:x2 + 1] != 0
+    grid[y1:y2, x1:x2][filled] = value
+    return x1, y1, x2, y2
+
+def get_brush_stroke(x1, y1, x2, y2, radius):
+    """
+    Arguments:
+        x1, y1, x2, y2: Cells at the start and end of the stroke, e.g. under the mouse at two consecutive motion events
+        radius: Number of cells the brush extends past its center cell on each side, i.e. the brush is a square of
+            2*radius+1 cells
+
+    Returns:
+        (mask_x1, mask_y1, mask), where mask is a 2d boolean array of every cell covered by the brush as it's swept
+            in a straight line from (x1, y1) to (x2, y2), and (mask_x1, mask_y1) is the cell at its top-left corner.
+            The mask may extend past the edges of the grid it's for.
+    """
+    # Center the brush on every cell of the line between the two cells, with no gaps between them, then grow each of
+    # these centers into a full brush with a dilation
+    steps = max(abs(x2 - x1), abs(y2 - y1)) + 1
+    line_xs = np.rint(np.linspace(x1, x2, steps)).astype(np.int64)
+    line_ys = np.rint(np.linspace(y1, y2, steps)).astype(np.int64)
+    mask_x1 = min(x1, x2) - radius
+    mask_y1 = min(y1, y2) - radius
+    mask = np.zeros((abs(y2 - y1) + 2*radius + 1, abs(x2 - x1) + 2*radius + 1), dtype=np.uint8)
+    mask[line_ys - mask_y1, line_xs - mask_x1] = 1
+    mask = cv2.dilate(mask, np.ones((2*radius + 1, 2*radius + 1), dtype=np.uint8))
+    return mask_x1, mask_y1, mask != 0
+
 def is_float(x):
     try:
         float(x)
@@ -0,0 +1,111 @@
+"""
+Helpers for picking the batch size each classifier in PredictionGrids classifies subsections with.
+
+Larger batches mean fewer predict calls, and therefore much less per-call overhead, but only up to the point where
+    the classifier stops getting faster per subsection or we run out of memory. So we bound the batch size by the
+    available memory, then find the fastest batch size under that bound by timing the classifier on this machine,
+    and cache the result for each classifier on each machine, and for the parameters it was tuned with, so that we
+    only have to time it once.
+"""
+import os
+import json
+import time
+import platform
+
+import numpy as np
+import psutil
+
+batch_size_cache_fpath = "../data/batch_sizes.json"  # Where we cache the batch size chosen for each model and machine
+
+def get_cache_key(classifier_fpath, input_shape, queued_batch_n, memory_fraction, runtime, precision, num_threads):
+    # Key of the batch size cached for this classifier on this machine, tuned with these parameters. The memory
+    # parameters bound the batch sizes we try, and the runtime, precision and number of threads change how fast each
+    # batch size is, so a batch size tuned with different ones may not be the fastest.
+    return "{}@{}|input_shape={}|queued_batch_n={}|memory_fraction={}|runtime={}|precision={}|threads={}".format(
+        os.path.basename(classifier_fpath), platform.node(), "x".join(str(dim) for dim in input_shape),
+        queued_batch_n, memory_fraction, runtime, precision, num_threads if num_threads is not None else "default")
+
+def get_sample_bytes(classifier, input_shape):
+    # Approximate memory used for each input classified by classifier.predict, as the input converted to float32
+    # plus the float32 outputs of every layer in the classifier. Classifiers from inference_runtime measure this
+    # themselves.
+    if not hasattr(classifier, "layers"):
+        return 4 * int(np.prod(input_shape)) + classifier.sample_bytes()
+    sample_bytes = 4 * int(np.prod(input_shape))
+    for layer in classifier.layers:
+        try:
+            output_shapes = layer.output_shape
+        except AttributeError:
+            continue
+        if not isinstance(output_shapes, list):
+            output_shapes = [output_shapes]
+        for output_shape in output_shapes:
+            sample_bytes += 4 * int(np.prod([dim for dim in output_shape[1:] if dim is not None]))
+    return sample_bytes
+
+def get_max_batch_size(classifier, input_shape, queued_batch_n=0, memory_fraction=0.25):
+    # Largest batch size which fits in memory_fraction of the currently available memory, including queued_batch_n
+    # more batches of uint8 inputs waiting to be classified.
+    batch_bytes = get_sample_bytes(classifier, input_shape) + queued_batch_n * int(np.prod(input_shape))
+    return max(1, int(psutil.virtual_memory().available * memory_fraction) // batch_bytes)
+
+def autotune_batch_size(classifier, input_shape, max_batch_size, min_batch_size=16, min_gain=0.05):
+    # Time classifier.predict on random inputs with doubling batch sizes, starting at min_batch_size, until either
+    # max_batch_size is reached or the throughput (inputs per second) stops improving by at least min_gain.
+    # Returns the batch size with the best throughput.
+    best_batch_size = min(min_batch_size, max_batch_size)
+    best_throughput = 0
+    batch_size = best_batch_size
+    while True:
+        inputs = np.random.randint(0, 256, size=(batch_size,) + tuple(input_shape), dtype=np.uint8)
+
+        # The first call includes one-time setup, so we only time the second
+        classifier.predict(inputs, batch_size=batch_size)
+        start = time.time()
+        classifier.predict(inputs, batch_size=batch_size)
+        throughput = batch_size / max(time.time() - start, 1e-6)
+
+        if throughput < best_throughput * (1 + min_gain):
+            break
+        best_batch_size = batch_size
+        best_throughput = throughput
+        if batch_size >= max_batch_size:
+            break
+        batch_size = min(batch_size * 2, max_batch_size)
+    return best_batch_size
+
+def get_batch_size(classifier, classifier_fpath, input_shape, queued_batch_n=0, memory_fraction=0.25, autotune=True,
+                   default_batch_size=256, runtime="keras", precision="float32", num_threads=None):
+    """
+    Arguments:
+        classifier: Keras model to get the batch size for
+        classifier_fpath: File the classifier was loaded from, used to identify it in our cache
+        input_shape: Shape of each input, e.g. (sub_h, sub_w, 3)
+        queued_batch_n: Number of batches that may be waiting to be classified at once
+        memory_fraction: Fraction of the available memory the classifier's batches may use
+        autotune: If True, time the classifier to find its fastest batch size when we don't have one cached.
+            Otherwise, we use default_batch_size.
+        runtime, precision, num_threads: Runtime the classifier was loaded with by inference_runtime.load_classifier,
+            the precision of its export, and the number of threads it classifies with (None for the default)
+
+    Returns:
+        The batch size to classify with, which is never more than what fits in the available memory.
+    """
+    max_batch_size = get_max_batch_size(classifier, input_shape, queued_batch_n=queued_batch_n,
+                                        memory_fraction=memory_fraction)
+    key = get_cache_key(classifier_fpath, input_shape, queued_batch_n, memory_fraction, runtime, precision, num_threads)
+
+    cache = {}
+    if os.path.exists(batch_size_cache_fpath):
+        with open(batch_size_cache_fpath, 'r') as f:
+            cache = json.load(f)
+
+    if key in cache:
+        return min(cache[key], max_batch_size)
+    if not autotune:
+        return min(default_batch_size, max_batch_size)
+
+    cache[key] = autotune_batch_size(classifier, input_shape, max_batch_size)
+    with open(batch_size_cache_fpath, 'w') as f:
+        json.dump(cache, f)
+    return cache[key]
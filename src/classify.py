@@ -10,5 +10,8 @@ def classify():
     dataset.get_stats()
     return dataset
 
-classify()
-messagebox.showinfo(title="L.I.R.A. Finished", message="All results have been generated. The program will now close.")
+# Guarded, since worker processes started with the "spawn" method import this module again
+if __name__ == "__main__":
+    classify()
+    messagebox.showinfo(title="L.I.R.A. Finished",
+                        message="All results have been generated. The program will now close.")
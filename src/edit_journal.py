@@ -0,0 +1,95 @@
+"""
+Undo/redo journal of the edits made to each prediction grid in PredictionGridEditor.
+
+Instead of keeping a copy of the entire prediction grid (and displayed image) for every edit, each edit is recorded
+    as the sections of the grid it changed, with the classifications in each section before and after the edit.
+    So an edit only takes as much memory as the area it changed, and undoing or redoing it only has to update that
+    area. Each image has its own history, which is kept when switching between images.
+"""
+import numpy as np
+
+class EditJournal(object):
+    """
+    Each edit is a list of patches (x1, y1, old, new), where old and new are the sections of the grid with
+        top-left corner (x1, y1) before and after the edit. An edit is started with begin(), and every change made
+        until the next begin() is recorded into it, e.g. so that an entire paintbrush stroke is undone at once.
+    """
+    def __init__(self, max_edits=100):
+        self.max_edits = max_edits  # Number of edits kept in each image's history
+        self.undos = {}  # Image index -> list of edits which can be undone, from oldest to newest
+        self.redos = {}  # Image index -> list of edits which can be redone, from newest to oldest
+
+    def begin(self, img_i):
+        # Start a new edit on image img_i, discarding the previous one if it didn't change anything
+        undos = self.undos.setdefault(img_i, [])
+        if len(undos) > 0 and len(undos[-1]) == 0:
+            undos.pop()
+        undos.append([])
+        if len(undos) > self.max_edits:
+            undos.pop(0)
+
+    def record(self, img_i, x1, y1, old, new):
+        # Record that the section of image img_i's grid with top-left corner (x1, y1) changed from old to new,
+        # as part of the current edit. Only the bounding box of the cells which actually changed is kept.
+        changed_rows, changed_cols = np.nonzero(old != new)
+        if len(changed_rows) == 0:
+            return
+        row1, row2 = np.min(changed_rows), np.max(changed_rows) + 1
+        col1, col2 = np.min(changed_cols), np.max(changed_cols) + 1
+        undos = self.undos.setdefault(img_i, [])
+        if len(undos) == 0:
+            self.begin(img_i)
+        undos[-1].append((x1 + col1, y1 + row1,
+                          np.copy(old[row1:row2, col1:col2]), np.copy(new[row1:row2, col1:col2])))
+
+        # A new edit replaces anything that was undone
+        self.redos[img_i] = []
+
+    def can_undo(self, img_i):
+        return any(len(edit) > 0 for edit in self.undos.get(img_i, []))
+
+    def can_redo(self, img_i):
+        return len(self.redos.get(img_i, [])) > 0
+
+    def undo(self, img_i, prediction_grid):
+        """
+        Undo the last edit on image img_i in prediction_grid, in place.
+
+        Returns:
+            The bounding box (x1, y1, x2, y2) of the section of the grid that changed, or None if there was nothing
+                to undo.
+        """
+        undos = self.undos.get(img_i, [])
+        while len(undos) > 0 and len(undos[-1]) == 0:
+            undos.pop()
+        if len(undos) == 0:
+            return None
+        edit = undos.pop()
+        for x1, y1, old, new in reversed(edit):
+            prediction_grid[y1:y1 + old.shape[0], x1:x1 + old.shape[1]] = old
+        self.redos.setdefault(img_i, []).append(edit)
+        return get_edit_bounds(edit)
+
+    def redo(self, img_i, prediction_grid):
+        """
+        Redo the last undone edit on image img_i in prediction_grid, in place.
+
+        Returns:
+            The bounding box (x1, y1, x2, y2) of the section of the grid that changed, or None if there was nothing
+                to redo.
+        """
+        redos = self.redos.get(img_i, [])
+        if len(redos) == 0:
+            return None
+        edit = redos.pop()
+        for x1, y1, old, new in edit:
+            prediction_grid[y1:y1 + new.shape[0], x1:x1 + new.shape[1]] = new
+        self.undos.setdefault(img_i, []).append(edit)
+        return get_edit_bounds(edit)
+
+def get_edit_bounds(edit):
+    # Bounding box (x1, y1, x2, y2) of every patch in edit
+    return (min(x1 for x1, y1, old, new in edit),
+            min(y1 for x1, y1, old, new in edit),
+            max(x1 + old.shape[1] for x1, y1, old, new in edit),
+            max(y1 + old.shape[0] for x1, y1, old, new in edit))
@@ -0,0 +1,25 @@
+#python3 export_classifiers.py float16
+#Exports each of our classifiers to a TensorFlow Lite model with the given precision (float32, float16, or dynamic),
+#for PredictionGrids and TypeOneDetections to use with runtime = "tflite". See inference_runtime.
+import sys
+
+from keras.models import load_model
+from keras_retinanet import models
+
+from inference_runtime import export_classifier
+
+precision = sys.argv[1] if len(sys.argv) > 1 else "float32"
+
+classifier_fpaths = [
+    "../classifiers/type_one_classifier.h5",
+    "../classifiers/non_type_one_classifier.h5",
+    "../classifiers/balbc_classifier.h5",
+]
+for fpath in classifier_fpaths:
+    error = export_classifier(load_model(fpath), fpath, precision=precision)
+    print("Exported {} at {} precision, max relative difference {:.2e}".format(fpath, precision, error))
+
+detector_fpath = "../classifiers/type_one_detection_classifier_resnet50.h5"
+detector = models.convert_model(models.load_model(detector_fpath, backbone_name='resnet50'))
+error = export_classifier(detector, detector_fpath, precision=precision)
+print("Exported {} at {} precision, max relative difference {:.2e}".format(detector_fpath, precision, error))
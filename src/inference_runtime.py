@@ -0,0 +1,166 @@
+"""
+Runtime for classifying with our .h5 classifiers without going through Keras.
+
+Keras adds a lot of overhead to every predict call, which dominates when we're running on cpu only. So we can instead
+    export each classifier once to a TensorFlow Lite model, which is frozen (constant folded and graph optimized) for
+    cpu inference, and optionally stored at reduced precision:
+        "float32": Same precision as the original classifier
+        "float16": Weights stored as float16
+        "dynamic": Weights quantized to int8, with activations quantized dynamically at inference
+    Every export is checked against the original classifier before it's saved, so a reduced precision export that
+    changes our predictions too much is never used.
+
+load_classifier is used in place of keras' load_model, and returns either the Keras model or a TFLiteClassifier,
+    which both support the same predict() call.
+"""
+import os
+
+import numpy as np
+import tensorflow as tf
+from keras.models import load_model
+
+precisions = ["float32", "float16", "dynamic"]
+
+# Maximum difference allowed between the outputs of an export and the original classifier, relative to the largest
+# output of the original classifier, for each precision.
+parity_tolerances = {"float32": 1e-4, "float16": 1e-2, "dynamic": 5e-2}
+
+def get_export_fpath(fpath, precision):
+    # e.g. ../classifiers/type_one_classifier.h5 -> ../classifiers/type_one_classifier_float16.tflite
+    return "{}_{}.tflite".format(os.path.splitext(fpath)[0], precision)
+
+class TFLiteClassifier(object):
+    """
+    Classifier exported by export_classifier, with the same predict() call as a Keras model. Each call classifies the
+        entire input at once, resizing the model's input to the input's batch size when it changes.
+
+    Not thread-safe, so each thread (or process) classifying at once needs its own TFLiteClassifier.
+    """
+    def __init__(self, fpath, num_threads=None):
+        self.fpath = fpath
+        self.interpreter = tf.lite.Interpreter(model_path=self.fpath, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self.input_details = self.interpreter.get_input_details()[0]
+
+        # Keep outputs in the same order as the original classifier's, which are named ...:0, ...:1, etc.
+        self.output_details = sorted(self.interpreter.get_output_details(),
+                                     key=lambda output: int(output["name"].split(":")[-1])
+                                     if output["name"].split(":")[-1].isnumeric() else 0)
+        self.input_shape = tuple(self.input_details["shape"])
+
+    def sample_bytes(self):
+        # Approximate memory used for each input classified, as the size of every tensor in the model for one input.
+        # Used by batch_sizing in place of summing the layer outputs of a Keras model.
+        return sum(int(np.prod(tensor["shape"][1:])) * np.dtype(tensor["dtype"]).itemsize
+                   for tensor in self.interpreter.get_tensor_details() if len(tensor["shape"]) > 1)
+
+    def predict(self, x, batch_size=None):
+        # batch_size is accepted to match Keras' predict, but the entire input is always classified at once.
+        x = np.asarray(x, dtype=self.input_details["dtype"])
+        if x.shape != self.input_shape:
+            self.interpreter.resize_tensor_input(self.input_details["index"], x.shape)
+            self.interpreter.allocate_tensors()
+            self.input_shape = x.shape
+        self.interpreter.set_tensor(self.input_details["index"], x)
+        self.interpreter.invoke()
+        outputs = [self.interpreter.get_tensor(output["index"]) for output in self.output_details]
+        return outputs[0] if len(outputs) == 1 else outputs
+
+def check_parity(model, exported, inputs, precision):
+    """
+    Check that exported gives the same outputs as model on inputs, to within parity_tolerances[precision].
+
+    Returns:
+        The maximum difference between their outputs, relative to the largest output of model.
+
+    Raises:
+        ValueError if the difference is over the tolerance.
+    """
+    model_outputs = model.predict(inputs, batch_size=len(inputs))
+    exported_outputs = exported.predict(inputs)
+    if not isinstance(model_outputs, list):
+        model_outputs, exported_outputs = [model_outputs], [exported_outputs]
+
+    error = 0
+    for model_output, exported_output in zip(model_outputs, exported_outputs):
+        model_output = np.asarray(model_output, dtype=np.float64)
+        scale = max(1, np.max(np.abs(model_output)))
+        error = max(error, np.max(np.abs(model_output - exported_output)) / scale)
+    if error > parity_tolerances[precision]:
+        raise ValueError("{} export differs from the original classifier by {:.2e}, over the tolerance of {:.2e}."
+                         .format(precision, error, parity_tolerances[precision]))
+    return error
+
+def export_classifier(model, fpath, precision="float32", sample_inputs=None):
+    """
+    Export the Keras model loaded from fpath to a TensorFlow Lite model at get_export_fpath(fpath, precision), after
+        checking that the export gives the same outputs as model on sample_inputs.
+
+    Arguments:
+        model: Keras model to export
+        fpath: File the model was loaded from
+        precision: One of precisions
+        sample_inputs: Inputs to check parity on. Defaults to random uint8 images of the model's input shape.
+
+    Returns:
+        The maximum relative difference found by check_parity.
+    """
+    if precision not in precisions:
+        raise ValueError("Unknown precision {}, expected one of {}.".format(precision, precisions))
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+
+    # Ops TensorFlow Lite doesn't have natively (e.g. in our detection model's non max suppression) fall back to
+    # TensorFlow's own
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+    if precision == "float16":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.target_spec.supported_types = [tf.float16]
+    elif precision == "dynamic":
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    exported_content = converter.convert()
+
+    if sample_inputs is None:
+        # Models which take any input size (e.g. our detection model) are checked on one 512x512 input instead
+        sample_n = 16 if None not in model.input_shape[1:] else 1
+        input_shape = tuple(dim if dim is not None else 512 for dim in model.input_shape[1:])
+        sample_inputs = np.random.randint(0, 256, size=(sample_n,) + input_shape).astype(np.float32)
+
+    # Check parity before saving, so a failed export never replaces a good one
+    export_fpath = get_export_fpath(fpath, precision)
+    tmp_fpath = export_fpath + ".tmp"
+    with open(tmp_fpath, 'wb') as f:
+        f.write(exported_content)
+    try:
+        error = check_parity(model, TFLiteClassifier(tmp_fpath), sample_inputs, precision)
+    except:
+        os.remove(tmp_fpath)
+        raise
+    os.replace(tmp_fpath, export_fpath)
+    return error
+
+def load_classifier(fpath, runtime="keras", precision="float32", load_keras_model=None, num_threads=None):
+    """
+    Load the classifier at fpath to classify with.
+
+    Arguments:
+        fpath: .h5 file of the classifier
+        runtime: "keras" to classify with the Keras model, or "tflite" to classify with its TensorFlow Lite export,
+            which is exported first if it doesn't exist yet.
+        precision: Precision of the TensorFlow Lite export, one of precisions
+        load_keras_model: Function to load the Keras model, for models which need more than load_model(fpath)
+        num_threads: Number of threads for the TensorFlow Lite runtime to use, or None for its default
+
+    Returns:
+        A Keras model or TFLiteClassifier
+    """
+    if load_keras_model is None:
+        load_keras_model = lambda: load_model(fpath)
+
+    if runtime == "keras":
+        return load_keras_model()
+    elif runtime == "tflite":
+        if not os.path.exists(get_export_fpath(fpath, precision)):
+            export_classifier(load_keras_model(), fpath, precision=precision)
+        return TFLiteClassifier(get_export_fpath(fpath, precision), num_threads=num_threads)
+    raise ValueError("Unknown runtime {}, expected \"keras\" or \"tflite\".".format(runtime))
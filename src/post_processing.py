@@ -6,6 +6,8 @@ Further documentation found in each function.
 -Blake Edwards / Dark Element
 """
 import sys
+from functools import lru_cache
+
 import numpy as np
 from scipy.sparse import csr_matrix, eye
 from scipy.sparse.linalg import bicg
@@ -67,7 +69,214 @@ def normalize_adjacency_matrix(adjacency_matrix):
     normalized_adjacency_matrix = degree_matrix.dot(adjacency_matrix.dot(degree_matrix))#DAD
     return normalized_adjacency_matrix
 
-def denoise_predictions(predictions, neighbor_weight):
+def get_adjacency_matrix(h, w):
+    """
+    Helper function for denoise_predictions.
+
+    Arguments:
+        h, w: Shape of our grid of predictions
+
+    Returns:
+        adjacency_matrix: CSR matrix of size (h*w, h*w), connecting each node in an h x w grid 
+            (flattened row by row) to all of its nearby nodes.
+    """
+    """
+    Each node i is connected to the nodes at a fixed set of offsets from it, which depends only on whether i is in 
+        the first column, the last column, or neither:
+
+        last column:  i-(w+1), i-w, i-1, i+(w-1), i+w
+        first column: i-w, i-(w-1), i+1, i+w, i+(w+1)
+        otherwise:    all 8 of i-(w+1), i-w, i-(w-1), i-1, i+1, i+(w-1), i+w, i+(w+1)
+
+    Connections to nodes before the first row or after the last row are dropped.
+
+    So instead of looping through every node, we get the nodes in each of these three groups at once, 
+        and add all their connections for each offset at once with index arithmetic.
+        This is O(n) in the number of connections, with only a constant number of numpy operations.
+    """
+    n = h*w
+    nodes = np.arange(n)
+    last_col = nodes % w == w-1
+    first_col = np.logical_and(nodes % w == 0, np.logical_not(last_col))
+    other_col = np.logical_not(np.logical_or(last_col, first_col))
+
+    rows = []
+    cols = []
+    for col_mask, offsets in [
+        (last_col, [-(w+1), -w, -1, w-1, w]),
+        (first_col, [-w, -(w-1), 1, w, w+1]),
+        (other_col, [-(w+1), -w, -(w-1), -1, 1, w-1, w, w+1])
+    ]:
+        src = nodes[col_mask]
+        for offset in offsets:
+            dst = src + offset
+            valid = np.logical_and(dst >= 0, dst < n)
+            rows.append(src[valid])
+            cols.append(dst[valid])
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    data = np.ones(len(rows), dtype=np.float64)
+
+    """
+    Using our data and row and column indices, we create our adjacency matrix as a CSR Sparse matrix
+    """
+    return csr_matrix((data, (rows, cols)), shape=(n, n))
+
+@lru_cache(maxsize=8)
+def get_normalized_adjacency_matrix(h, w):
+    """
+    Helper function for denoise_predictions.
+
+    Returns normalize_adjacency_matrix(get_adjacency_matrix(h, w)), cached for the most recent shapes
+        so that slides of the same size reuse it. Since it's shared, the result should never be modified.
+    """
+    return normalize_adjacency_matrix(get_adjacency_matrix(h, w))
+
+def solve_columns(A, b, x0=None, tol=1e-5, maxiter=None):
+    """
+    Helper function for denoise_predictions.
+
+    Arguments:
+        A: Symmetric positive definite sparse matrix of size n x n
+        b: np array of shape (n, m)
+        x0: Initial guess for x, of shape (n, m). Defaults to zeros.
+        tol: Stop on each column once the norm of its residual is at most tol times the norm of that column of b,
+            the same convergence criterion as scipy's solvers.
+        maxiter: Maximum number of iterations, defaults to 10*n like scipy's solvers.
+
+    Returns:
+        x: np array of shape (n, m), solving Ax = b for all columns of b at once.
+    """
+    """
+    This is Conjugate Gradient run on every column at the same time. Each column gets its own step sizes
+        (alpha and beta), exactly as if it was solved on its own, but the sparse dot product of A with our
+        search directions, which is most of the work, is done once for all columns per iteration. 
+    Columns which have converged stop being updated.
+    """
+    n, m = b.shape
+    if maxiter is None:
+        maxiter = 10*n
+    b = np.asarray(b, dtype=np.float64)
+    x = np.zeros((n, m), dtype=np.float64) if x0 is None else np.array(x0, dtype=np.float64)
+
+    r = b - A.dot(x)
+    p = r.copy()
+    rs = np.sum(r*r, axis=0)
+    thresholds = (tol * np.linalg.norm(b, axis=0))**2
+    for iteration in range(maxiter):
+        active = rs > thresholds
+        if not np.any(active):
+            break
+        Ap = A.dot(p)
+        pAp = np.sum(p*Ap, axis=0)
+        alpha = np.where(active, rs / np.where(active, pAp, 1), 0)
+        x += alpha*p
+        r -= alpha*Ap
+        rs_new = np.sum(r*r, axis=0)
+        beta = np.where(active, rs_new / np.where(active, rs, 1), 0)
+        p = r + beta*p
+        rs = rs_new
+    return x
+
+def get_neighbor_sums(x):
+    """
+    Helper function for denoise_predictions_neumann.
+
+    Arguments:
+        x: np array of shape (h, w, ...)
+
+    Returns:
+        np array of the same shape as x, where each element is the sum of the (up to 8) elements next to it 
+            in the h x w grid. This is a 3x3 convolution with a kernel of ones and a zero center, 
+            and for w > 1 is the same as get_adjacency_matrix(h, w).dot(x) with x flattened to (h*w, ...).
+    """
+    """
+    We get this as the sum over each 3x3 block, computed separably as the sum of each 3 rows then of each 3 columns
+        of that, minus the center.
+    """
+    padded = np.pad(x, [(1, 1), (1, 1)] + [(0, 0)] * (x.ndim - 2))
+    row_sums = padded[:-2] + padded[1:-1] + padded[2:]
+    return row_sums[:, :-2] + row_sums[:, 1:-1] + row_sums[:, 2:] - x
+
+def denoise_predictions_neumann(predictions, neighbor_weight, iterations=30):
+    """
+    Arguments:
+        predictions, neighbor_weight: Same as denoise_predictions. predictions must be at least 2 wide.
+        iterations: Number of terms of the series to add after the first, see below.
+
+    Returns:
+        An approximation of denoise_predictions(predictions, neighbor_weight), of the same shape (h, w, class_n).
+            Its error is bounded by get_neumann_error_bound.
+    """
+    """
+    denoise_predictions solves (I - l*M)*f = (1-l)*y for f. Since the eigenvalues of l*M are all less than 1 in 
+        magnitude, we can instead expand the inverse as a Neumann series:
+
+        f = (1-l) * (I + l*M + (l*M)^2 + (l*M)^3 + ...) * y
+
+    And approximate f by only adding the first iterations+1 terms, each of which we get from the last with
+        one more multiplication by l*M.
+
+    Since M = D^(-1/2) * A * D^(-1/2), and A just sums up each node's neighbors on our h x w grid, 
+        multiplying by M is a convolution of our predictions over the grid, scaled by D^(-1/2) before and after.
+        So we never have to build any matrices, only repeatedly convolve our (h, w, class_n) array.
+
+    We also keep each term scaled by D^(-1/2), so that the scaling after one multiplication and before the next 
+        combine into a single scaling by D^(-1), and only scale back by D^(1/2) once at the end.
+    """
+    degrees = get_neighbor_sums(np.ones(predictions.shape[:2], dtype=np.float32))
+    degrees = np.reshape(degrees, degrees.shape + (1,))
+
+    term = (1.-neighbor_weight) * np.asarray(predictions, dtype=np.float32) / np.sqrt(degrees)
+    denoised_predictions = term.copy()
+    for iteration in range(iterations):
+        term = get_neighbor_sums(term)
+        term *= neighbor_weight / degrees
+        denoised_predictions += term
+    return denoised_predictions * np.sqrt(degrees)
+
+def get_neumann_error_bound(predictions, neighbor_weight, iterations=30):
+    """
+    Arguments:
+        predictions, neighbor_weight, iterations: Same as denoise_predictions_neumann.
+
+    Returns:
+        Upper bound on the largest absolute difference between any element of 
+            denoise_predictions(predictions, neighbor_weight, method="neumann", iterations=iterations) and the exact
+            solution. This is 0 for grids one node wide, since those always use the exact method.
+    """
+    """
+    The error is the rest of the series, (1-l) * ((l*M)^(iterations+1) + (l*M)^(iterations+2) + ...) * y.
+
+    We can write M = D^(1/2) * P * D^(-1/2), where P = D^(-1) * A averages each node's neighbors, 
+        so no element of P^k * y is ever larger than the largest element of y.
+        Therefore no element of (l*M)^k * y is larger than l^k * sqrt(max(D) / min(D)) * max(|y|).
+
+    Summing this over the rest of the series gives the bound:
+
+        l^(iterations+1) * sqrt(max(D) / min(D)) * max(|y|)
+    """
+    if predictions.shape[1] <= 1:
+        return 0.
+    degrees = get_neighbor_sums(np.ones(predictions.shape[:2]))
+    return neighbor_weight ** (iterations + 1) * np.sqrt(np.max(degrees) / np.min(degrees)) * np.max(np.abs(predictions))
+
+def get_neumann_error(predictions, neighbor_weight, iterations=30):
+    """
+    Arguments:
+        predictions, neighbor_weight, iterations: Same as denoise_predictions_neumann.
+
+    Returns:
+        (error, bound), where error is the largest absolute difference between any element of 
+            denoise_predictions(predictions, neighbor_weight, method="neumann", iterations=iterations) and
+            denoise_predictions' exact solution, and bound is get_neumann_error_bound.
+        Useful for choosing iterations, since this has to find the exact solution.
+    """
+    exact = denoise_predictions(predictions, neighbor_weight, tol=1e-10)
+    approximate = denoise_predictions(predictions, neighbor_weight, method="neumann", iterations=iterations)
+    return np.max(np.abs(exact - approximate)), get_neumann_error_bound(predictions, neighbor_weight, iterations)
+
+def denoise_predictions(predictions, neighbor_weight, tol=1e-5, warm_start=True, method="exact", iterations=30):
     """
     Arguments:
         predictions: np array of shape (h, w, class_n), the predictions.
@@ -77,6 +286,11 @@ def denoise_predictions(predictions, neighbor_weight):
             How much importance to put on the neighbor values. 
             This could also be thought of as a smoothing factor.
             Should be between 0 and 1
+        tol: Relative tolerance for solving for our denoised predictions, see solve_columns.
+        warm_start: If True, start solving from our original predictions instead of from zeros.
+        method: "exact" to solve for our denoised predictions, or "neumann" to approximate them much faster
+            with denoise_predictions_neumann, within get_neumann_error_bound of the exact solution.
+        iterations: Number of iterations for the "neumann" method.
 
     Returns:
         Each "prediction" is an element in our predictions input,
@@ -90,6 +304,13 @@ def denoise_predictions(predictions, neighbor_weight):
 
         Returns a new predictions array, of the same shape (h, w, class_n) as the original.
     """
+    """
+    Grids only one node wide always use the exact method, since they're tiny and their adjacency matrix 
+        isn't the same as a convolution (see get_adjacency_matrix).
+    """
+    if method == "neumann" and predictions.shape[1] > 1:
+        return denoise_predictions_neumann(predictions, neighbor_weight, iterations)
+
     """
     First we need to create an adjacency matrix for each entry in our predictions array, 
         as if each node was a prediction vector, so that the graph is a rectangle of shape h x w,
@@ -114,88 +335,18 @@ def denoise_predictions(predictions, neighbor_weight):
         would contain h*w * h*w elements, = 300*400 * 300*400 = 120000 * 120000 = 1.44e10 .
 
     Due to the simple nature of our graph, undirected and where each node is connected in a simple and deterministic manner to its neighbors,
-        we can construct it with O(n) complexity. I designed a way to incrementally create each row in this matrix given the h and w,
-        as this is all that's necessary given our knowledge of how the graph is constructed. I could loop through every element and construct it
-        the way it would be done by hand, however this would have O(n^2) complexity, and since n = h*w, that is really really bad. For the sake
-        of optimizing down to O(n), I had to observe and replicate the patterns in adjacency matrices of this type. It is not as obviously intuitive 
-        as the by-hand method, however it will run at O(n), able to loop through and construct rows of the adjacency matrix at a time.
+        we can construct it with O(n) complexity, see get_adjacency_matrix.
     """
-    """
-    Prepare these lists for constructing our CSR matrix
-    """
-    rows = []
-    cols = []
-    data = []
-
     """
     Get this data from our shape
     """
     h, w, class_n = predictions.shape
 
-    def ins(i, j, x):
-        """
-        Arguments:
-            i: row index of x
-            j: col index of x
-            x: data to add
-        Returns:
-            Adds i, our row index, to the row indices list
-            Adds j, our col index, to the col indices list
-            Adds x, our data, to the data list
-
-            This is just a quick function to save time in the next steps.
-        """
-        if j >= 0 and j < h*w:
-            rows.append(i)
-            cols.append(j)
-            data.append(x)
-
-
-    """
-    Loop through and construct our rows
-    """
-    for i in range(h*w):
-        if i % w == w-1:
-            ins(i, i-(w+1), 1)
-            ins(i, i-(w), 1)
-            ins(i, i-1, 1)
-            ins(i, i+(w-1), 1)
-            ins(i, i+(w), 1)
-
-        elif i % w == 0:
-            ins(i, i-(w), 1)
-            ins(i, i-(w-1), 1)
-            ins(i, i+1, 1)
-            ins(i, i+(w), 1)
-            ins(i, i+(w+1), 1)
-
-        else:
-            ins(i, i-(w+1), 1)
-            ins(i, i-(w), 1)
-            ins(i, i-(w-1), 1)
-            ins(i, i-1, 1)
-            ins(i, i+1, 1)
-            ins(i, i+(w-1), 1)
-            ins(i, i+(w), 1)
-            ins(i, i+(w+1), 1)
-
-    """
-    Now that lists are finished changing in size, 
-        we cast to nparrays
-    """
-    rows = np.array(rows)
-    cols = np.array(cols)
-    data = np.array(data)
-
-    """
-    Using our data and row and column indices, we create our adjacency matrix as a CSR Sparse matrix
-    """
-    adjacency_matrix = csr_matrix((data, (rows, cols)), shape=(h*w, h*w))
-
     """
-    We then normalize this adjacency matrix
+    Get our normalized adjacency matrix for this shape, which is cached so that predictions of the same shape
+        reuse it.
     """
-    normalized_adjacency_matrix = normalize_adjacency_matrix(adjacency_matrix)
+    normalized_adjacency_matrix = get_normalized_adjacency_matrix(h, w)
 
     """
     Then we use the following equation, from this paper:
@@ -250,21 +401,30 @@ def denoise_predictions(predictions, neighbor_weight):
         obtained through the dot product of A and x.
     
     What this means is that we can solve for the entire matrix x by solving for each of the columns
-        in x independently, looping across both the columns we are solving for in x and the other matching column
-        in b, and solving using normal least squares.
+        in x independently, with the other matching column in b.
+
+    Since A is the same for every column, we solve all of them together with solve_columns, 
+        so that each of its sparse dot products with A handles every column at once.
+        A is also symmetric positive definite, since M is symmetric with eigenvalues in [-1, 1] and l < 1,
+        so solve_columns can use Conjugate Gradient. 
+    If warm_start is True, we start from our original predictions, since our denoised predictions are a 
+        smoothed version of them and therefore usually close to them already.
 
     Remember that x is our new prediction values, so this is the last math-heavy step.
     """
-    x = np.zeros(b.shape, dtype=np.float32)
-    for i in range(class_n):
-        col = b[:,i]
-        col = np.reshape(col, (-1, 1))
+    x0 = predictions if warm_start else None
+    if w > 1:
+        x = solve_columns(A, b, x0=x0, tol=tol).astype(np.float32)
+    else:
         """
-        Solve for this column using Bi-Conjugate Gradient Iteration from scipy,
-            and set the result column into our resulting x matrix.
+        Grids only one node wide are the exception, since their adjacency matrix isn't symmetric 
+            (see get_adjacency_matrix), so A isn't either and we can't use Conjugate Gradient.
+            They're tiny, so we just solve each column using Bi-Conjugate Gradient Iteration from scipy instead.
         """
-        x[:,i], flags = bicg(A, col)
-    
+        x = np.zeros(b.shape, dtype=np.float32)
+        for i in range(class_n):
+            x[:,i], flags = bicg(A, b[:,i], x0=None if x0 is None else x0[:,i])
+
     """
     At this point our entire x result matrix has been constructed, 
         however it is of shape (h*w, class_n).
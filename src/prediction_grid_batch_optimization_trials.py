@@ -7,11 +7,13 @@ import numpy as np
 from Dataset import Dataset
 from base import *
 
-#Classify then get images for the resulting predictions
-dataset = Dataset()
-dataset.detect_type_ones()
-for mb in [23,24]:
-    start = time.time()
-    dataset.prediction_grids.mb_n = mb
-    dataset.predict_grids()
-    print("\nMB: {} s/grid: {}".format(mb, (time.time() - start)/3))
+# Guarded, since worker processes started with the "spawn" method import this module again
+if __name__ == "__main__":
+    #Classify then get images for the resulting predictions
+    dataset = Dataset()
+    dataset.detect_type_ones()
+    for mb in [23,24]:
+        start = time.time()
+        dataset.prediction_grids.mb_n = mb
+        dataset.predict_grids()
+        print("\nMB: {} s/grid: {}".format(mb, (time.time() - start)/3))
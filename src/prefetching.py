@@ -0,0 +1,125 @@
+"""
+Cache for the editors of the images neighbouring the one being edited, loaded on a background thread.
+
+Switching images in an editor means loading and resizing the next image from its archive, which blocks the editor
+    until it's done. So while the user edits one image, we load the images they're likely to switch to next (the
+    previous and next images) on a background thread, and keep them in a cache until they do. The cache holds as
+    many images as fit in max_mb, evicting the least recently used images first.
+"""
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+def get_nbytes(value):
+    # Memory used by the np arrays in value, which is either an np array or a tuple of them (and other values)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(get_nbytes(v) for v in value)
+    return 0
+
+class PrefetchCache(object):
+    """
+    LRU cache of load(i) for image indices i, which are loaded on a background thread when prefetched, or on the
+        calling thread if they're needed before then.
+
+    load must be safe to call from another thread, i.e. it may not use tkinter.
+    """
+    def __init__(self, load, max_mb=1024):
+        self.load = load
+        self.max_bytes = max_mb * 1024 * 1024
+        self.entries = OrderedDict()  # i -> load(i), from least to most recently used
+        self.nbytes = 0  # Memory used by our entries
+        self.pending = {}  # i -> Future of load(i), for each i being prefetched
+        self.lock = threading.Lock()
+        self.requests = queue.Queue()  # (i, Future of load(i)) for each i to prefetch, or None once we're closed
+
+        # A daemon thread, so that quitting never has to wait for a load in progress to finish
+        self.loader = threading.Thread(target=self.run, daemon=True)
+        self.loader.start()
+
+    def prefetch(self, indices):
+        # Start loading each of indices on our background thread, unless it's already cached or being loaded.
+        with self.lock:
+            for i in indices:
+                if i not in self.entries and i not in self.pending:
+                    self.pending[i] = Future()
+                    self.requests.put((i, self.pending[i]))
+
+    def run(self):
+        # Load each index we're asked to prefetch, until we're closed
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return
+            i, future = request
+            try:
+                future.set_result(self.load_pending(i, future))
+            except Exception as e:
+                future.set_exception(e)
+
+    def load_pending(self, i, future):
+        value = None
+        loaded = False
+        try:
+            value = self.load(i)
+            loaded = True
+            return value
+        finally:
+            with self.lock:
+                # Whether or not it loaded, i is no longer being prefetched, so a failed load is tried again the next
+                # time i is needed. We only cache it if it wasn't invalidated or prefetched again while we were
+                # loading it.
+                if self.pending.get(i) is future:
+                    del self.pending[i]
+                    if loaded:
+                        self.put_locked(i, value)
+
+    def get(self, i):
+        # Get load(i), from our cache if possible, otherwise waiting for it to be prefetched or loading it ourselves.
+        with self.lock:
+            if i in self.entries:
+                self.entries.move_to_end(i)
+                return self.entries[i]
+            future = self.pending.get(i)
+        if future is not None:
+            return future.result()
+        value = self.load(i)
+        self.put(i, value)
+        return value
+
+    def put(self, i, value):
+        # Cache value as load(i), e.g. when it's been edited since it was loaded
+        with self.lock:
+            self.pending.pop(i, None)
+            self.put_locked(i, value)
+
+    def put_locked(self, i, value):
+        if i in self.entries:
+            self.nbytes -= get_nbytes(self.entries.pop(i))
+        nbytes = get_nbytes(value)
+        if nbytes > self.max_bytes:
+            return
+        self.entries[i] = value
+        self.nbytes += nbytes
+
+        # Evict our least recently used entries until we fit in memory again
+        while self.nbytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= get_nbytes(evicted)
+
+    def invalidate(self, i):
+        # Remove i from our cache, and discard it if it's being prefetched
+        with self.lock:
+            self.pending.pop(i, None)
+            if i in self.entries:
+                self.nbytes -= get_nbytes(self.entries.pop(i))
+
+    def close(self):
+        # Stop prefetching, without waiting for any prefetch in progress
+        with self.lock:
+            self.pending = {}
+        self.requests.put(None)
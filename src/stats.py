@@ -0,0 +1,141 @@
+"""
+Helpers for computing the stats and displayable results Dataset.get_stats writes for a finished session.
+
+export_overlay is run in worker processes by Dataset.get_stats, so nothing in this file may use tkinter.
+"""
+import csv
+
+import cv2
+import numpy as np
+
+from base import get_prediction_overlay, weighted_overlay
+from SlideArchive import SlideArchive
+
+class_names = ["Healthy Tissue", "Type I - Caseum", "Type II", "Type III", "Type I - Rim", "Unknown/Misc"]
+stat_classes = [0, 1, 2, 4, 5, 6]  # Classifications we count, i.e. all but Empty Slide, in the order of class_names
+
+def get_class_counts(prediction_grids, class_n=7):
+    # Get an array of shape (len(prediction_grids), len(stat_classes)) with the number of predictions of each of our
+    # stat classes in each prediction grid, counting each grid with a single np.bincount.
+    counts = np.zeros((len(prediction_grids), class_n), dtype=np.int64)
+    for i, prediction_grid in enumerate(prediction_grids):
+        counts[i] = np.bincount(np.ravel(prediction_grid), minlength=class_n)[:class_n]
+    return counts[:, stat_classes]
+
+def get_slide_groups(fnames):
+    """
+    Images split from the same slide are named like "slide.czi (1)", "slide.czi (2)", etc., and we want their stats
+        combined under the slide's name. So consecutive images whose names end in ")" and are the same up to their
+        last space are grouped into one slide, named without the "(n)" part.
+
+    Returns:
+        (slide_names, slide_index), where slide_index[i] is the index in slide_names of image i's slide.
+    """
+    slide_names = []
+    slide_index = np.zeros((len(fnames),), dtype=np.int64)
+    last_group_name = None
+    for i, fname in enumerate(fnames):
+        if fname.endswith(")"):
+            group_name = " ".join(fname.split(" ")[:-1])
+            if group_name != last_group_name:
+                slide_names.append(group_name)
+        else:
+            group_name = None
+            slide_names.append(fname)
+        last_group_name = group_name
+        slide_index[i] = len(slide_names) - 1
+    return slide_names, slide_index
+
+def get_percentages(counts):
+    # Percentage of the total of each row of counts that each count takes up
+    counts = np.asarray(counts, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 100 * counts / np.sum(counts, axis=-1, keepdims=True)
+
+def write_stats(f, fnames, prediction_grids, detection_counts):
+    """
+    Write a CSV to the open file f with raw counts of each classification on each slide,
+        with the percentages each classification takes up of the slide, not including empty slide,
+        and the number of type one lesions detected on each slide,
+        followed by a summary row with the same for all slides combined.
+
+    Arguments:
+        f: File opened for writing with newline=""
+        fnames: Name of each image
+        prediction_grids: Prediction grid of each image
+        detection_counts: Number of type one lesions detected on each image
+    """
+    counts = get_class_counts(prediction_grids)
+    detection_counts = np.asarray(detection_counts, dtype=np.int64)
+
+    # Combine the counts of every image in each slide
+    slide_names, slide_index = get_slide_groups(fnames)
+    slide_counts = np.zeros((len(slide_names), counts.shape[1]), dtype=np.int64)
+    np.add.at(slide_counts, slide_index, counts)
+    slide_detection_counts = np.bincount(slide_index, weights=detection_counts, minlength=len(slide_names))
+    slide_percentages = get_percentages(slide_counts)
+
+    writer = csv.writer(f, lineterminator="\n")
+    writer.writerow(["Image"] + class_names + [""] + class_names + ["", "Number of Type One Lesions"])
+    for name, slide_count, slide_percentage, slide_detection_count in zip(
+            slide_names, slide_counts, slide_percentages, slide_detection_counts):
+        writer.writerow([name] + [float(count) for count in slide_count] + [""] + list(slide_percentage) +
+                        ["", int(slide_detection_count)])
+
+    total_counts = np.sum(counts, axis=0)
+    writer.writerow([])
+    writer.writerow(["summary"] + [float(count) for count in total_counts] + [""] +
+                    list(get_percentages(total_counts)) + ["", int(np.sum(detection_counts))])
+
+# Flag for the compression setting of each format we can write displayable results in, passed to cv2.imwrite with
+# the setting's value. For .png this is the compression level (0-9), for .jpg and .webp the quality (0-100), and for
+# .tif the compression scheme (e.g. 1 for none, 5 for LZW).
+overlay_compression_flags = {
+    ".png": cv2.IMWRITE_PNG_COMPRESSION,
+    ".jpg": cv2.IMWRITE_JPEG_QUALITY,
+    ".jpeg": cv2.IMWRITE_JPEG_QUALITY,
+    ".webp": cv2.IMWRITE_WEBP_QUALITY,
+    ".tif": cv2.IMWRITE_TIFF_COMPRESSION,
+    ".tiff": cv2.IMWRITE_TIFF_COMPRESSION,
+}
+
+def get_imwrite_params(overlay_format, compression=None):
+    # Params for cv2.imwrite to write an image in overlay_format with the given compression setting, or with
+    # OpenCV's default for the format if compression is None.
+    if overlay_format not in overlay_compression_flags:
+        raise ValueError("Unknown format {}, expected one of {}.".format(
+            overlay_format, list(overlay_compression_flags.keys())))
+    if compression is None:
+        return []
+    return [overlay_compression_flags[overlay_format], int(compression)]
+
+def export_overlay(archive_fpath, prediction_grid, sub_h, sub_w, color_key, alpha, fpath, imwrite_params=()):
+    """
+    Write a displayable image of prediction_grid overlaid on the image in the SlideArchive at archive_fpath,
+        with each prediction drawn as a sub_hxsub_w rectangle of its color in color_key.
+
+    Arguments:
+        archive_fpath: SlideArchive of the image
+        prediction_grid: Prediction grid of the image, after editing
+        sub_h, sub_w: Size of each prediction on the displayable image. The image is resized to match the grid,
+            reading it from the lowest resolution level of its archive that allows it.
+        color_key: Color of each classification
+        alpha: Transparency of the overlay
+        fpath: File to write the displayable image to. Its extension decides the format.
+        imwrite_params: Params for cv2.imwrite, e.g. from get_imwrite_params
+    """
+    archive = SlideArchive(archive_fpath)
+
+    # Since our image and predictions would be slightly misalgned from each other due to rounding,
+    # We compute the img resize factors from sub_h and sub_w to make them aligned.
+    img_shape = archive.shape()
+    fy = (prediction_grid.shape[0] * sub_h) / img_shape[0]
+    fx = (prediction_grid.shape[1] * sub_w) / img_shape[1]
+    img = archive.read_resized(fx, fy)
+
+    # Add overlay to image to get resulting image
+    prediction_overlay = get_prediction_overlay(prediction_grid, color_key, sub_h, sub_w, img.shape)
+    display_img = weighted_overlay(img, prediction_overlay, alpha)
+
+    if not cv2.imwrite(fpath, display_img, list(imwrite_params)):
+        raise IOError("Could not write {}.".format(fpath))
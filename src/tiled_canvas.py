@@ -0,0 +1,103 @@
+"""
+Tiled display of large images on a tkinter canvas, for the editors.
+
+Putting an entire resized slide into a single PhotoImage makes Tk keep a bitmap of the entire slide, even though
+    only the part of it in view is ever displayed. So instead the image is split into tiles, and only the tiles in
+    view are rendered and given a PhotoImage, as they come into view. Tiles which scroll out of view are kept until
+    more than max_tiles exist, evicting the least recently viewed tiles first, so memory and redraw time depend on the
+    size of the window rather than the size of the slide.
+"""
+from collections import OrderedDict
+
+from PIL import ImageTk, Image
+
+class TiledCanvasImage(object):
+    """
+    Displays an image of a given size on canvas with its top-left corner at (0, 0), where render(x1, y1, x2, y2) gives
+        the section y1:y2, x1:x2 of the image as an RGB np array. The canvas's scrollbars must be connected with
+        scroll_command(), so that we know when the view changes.
+    """
+    def __init__(self, canvas, render, tile_size=512, max_tiles=32):
+        self.canvas = canvas
+        self.render = render
+        self.tile_size = tile_size  # Width and height of each tile
+        self.max_tiles = max_tiles  # Number of tiles kept, unless more than this are in view at once
+        self.width = 0
+        self.height = 0
+        self.tiles = OrderedDict()  # (tile_x, tile_y) -> (PhotoImage, canvas item), from least to most recently viewed
+        self.refresh_id = None  # Scheduled refresh, if any
+
+    def scroll_command(self, scrollbar):
+        # Get an xscrollcommand / yscrollcommand for our canvas which updates scrollbar, then refreshes our tiles
+        # once the view has finished changing
+        def command(first, last):
+            scrollbar.set(first, last)
+            if self.refresh_id is None:
+                self.refresh_id = self.canvas.after_idle(self.refresh)
+        return command
+
+    def reset(self, width, height):
+        # Display a new image of this size, discarding every tile of the old one, and scroll back to its top-left
+        for image, item in self.tiles.values():
+            self.canvas.delete(item)
+        self.tiles = OrderedDict()
+        self.width, self.height = width, height
+        self.canvas.config(scrollregion=(0, 0, width, height))
+        self.canvas.xview_moveto(0)
+        self.canvas.yview_moveto(0)
+        self.refresh()
+
+    def get_visible_tiles(self):
+        # Get the (tile_x, tile_y) of every tile in view. The canvas's requested size is used until it's displayed.
+        view_x1 = int(self.canvas.canvasx(0))
+        view_y1 = int(self.canvas.canvasy(0))
+        view_x2 = view_x1 + max(self.canvas.winfo_width(), int(self.canvas.cget("width")))
+        view_y2 = view_y1 + max(self.canvas.winfo_height(), int(self.canvas.cget("height")))
+        tile_x1, tile_y1 = max(view_x1 // self.tile_size, 0), max(view_y1 // self.tile_size, 0)
+        tile_x2 = min(-(-view_x2 // self.tile_size), -(-self.width // self.tile_size))
+        tile_y2 = min(-(-view_y2 // self.tile_size), -(-self.height // self.tile_size))
+        return [(tile_x, tile_y) for tile_y in range(tile_y1, tile_y2) for tile_x in range(tile_x1, tile_x2)]
+
+    def refresh(self):
+        # Create the tiles in view which don't exist yet, then evict the least recently viewed tiles out of view
+        # until we're back to max_tiles
+        if self.refresh_id is not None:
+            self.canvas.after_cancel(self.refresh_id)
+            self.refresh_id = None
+        visible_tiles = self.get_visible_tiles()
+        for tile in visible_tiles:
+            if tile in self.tiles:
+                self.tiles.move_to_end(tile)
+            else:
+                self.tiles[tile] = self.create_tile(*tile)
+        while len(self.tiles) > max(self.max_tiles, len(visible_tiles)):
+            _, (image, item) = self.tiles.popitem(last=False)
+            self.canvas.delete(item)
+
+    def get_tile_coordinates(self, tile_x, tile_y):
+        # Get the coordinates x1, y1, x2, y2 of the section of the image in this tile
+        x1, y1 = tile_x * self.tile_size, tile_y * self.tile_size
+        return x1, y1, min(x1 + self.tile_size, self.width), min(y1 + self.tile_size, self.height)
+
+    def create_tile(self, tile_x, tile_y):
+        x1, y1, x2, y2 = self.get_tile_coordinates(tile_x, tile_y)
+        image = ImageTk.PhotoImage(Image.fromarray(self.render(x1, y1, x2, y2)))
+        item = self.canvas.create_image(x1, y1, image=image, anchor="nw")
+
+        # Keep our tiles below everything else drawn on the canvas, e.g. selections and detections
+        self.canvas.tag_lower(item)
+        return image, item
+
+    def update(self, x1, y1, x2, y2):
+        # Re-render the section y1:y2, x1:x2 of the image, after it's changed. Only the tiles we have are updated,
+        # and only where they overlap the section, since the rest are rendered when they next come into view.
+        for tile, (image, item) in self.tiles.items():
+            tile_x1, tile_y1, tile_x2, tile_y2 = self.get_tile_coordinates(*tile)
+            section_x1, section_y1 = max(x1, tile_x1), max(y1, tile_y1)
+            section_x2, section_y2 = min(x2, tile_x2), min(y2, tile_y2)
+            if section_x2 <= section_x1 or section_y2 <= section_y1:
+                continue
+            section_image = ImageTk.PhotoImage(
+                Image.fromarray(self.render(section_x1, section_y1, section_x2, section_y2)))
+            self.canvas.tk.call(str(image), "copy", str(section_image),
+                                "-to", section_x1 - tile_x1, section_y1 - tile_y1)
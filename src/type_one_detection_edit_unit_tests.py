@@ -1,5 +1,7 @@
 #Edits the current detections
 from TypeOneDetections import TypeOneDetections
 from Dataset import Dataset
-dataset = Dataset()
-dataset.detect_type_ones()
+# Guarded, since worker processes started with the "spawn" method import this module again
+if __name__ == "__main__":
+    dataset = Dataset()
+    dataset.detect_type_ones()
@@ -0,0 +1,105 @@
+"""
+Write-behind saving of the edits made in PredictionGridEditor.
+
+Saving the prediction grid after every edit would block the editor on disk I/O for every click and paintbrush
+    movement. So edits are instead queued here and saved on a background thread once no new edit has been queued
+    for delay seconds, with any number of edits to the same grid in that time saved only once, as the latest grid.
+    The editor flushes the queue itself whenever it needs its edits on disk, i.e. when switching images, finishing,
+    or quitting. If a background write fails, its data stays queued to be retried, and the error is raised from the
+    next call to save(), so that the editor can tell the user. The same goes for flush() and close(), which raise
+    the error themselves, leaving the data queued so that they can be retried.
+"""
+import threading
+import time
+
+import numpy as np
+
+class WriteBehindSaver(object):
+    """
+    Saves data queued with save(i, data) into editing_dataset[i] on a background thread, delay seconds after the
+        last call to save(). Each save is atomic, since EditingDataset writes to a temporary file and replaces the
+        archive with it.
+    """
+    def __init__(self, editing_dataset, delay=1.0):
+        self.editing_dataset = editing_dataset
+        self.delay = delay
+        self.pending = {}  # i -> latest data queued for editing_dataset[i]
+        self.last_save = 0  # Time of the last call to save(), or of the last failed write
+        self.closed = False
+        self.error = None  # Last error from writing in the background, until it's raised from save()
+        self.condition = threading.Condition()  # Guards pending, last_save, closed and error
+        self.write_lock = threading.Lock()  # Held while writing, so writes of the same data always happen in order
+        self.start()
+
+    def start(self):
+        # Start our background thread
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def save(self, i, data):
+        # Queue data to be saved as editing_dataset[i]. data is copied, so it can keep being edited in the meantime.
+        # Raises the last error from writing in the background, if there was one since the last call, after queuing.
+        with self.condition:
+            self.pending[i] = np.copy(data)
+            self.last_save = time.time()
+            self.condition.notify()
+            error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def run(self):
+        while True:
+            with self.condition:
+                # Wait until there's something to save and no new edit has been queued for self.delay seconds
+                while not self.closed and (len(self.pending) == 0 or time.time() - self.last_save < self.delay):
+                    if len(self.pending) == 0:
+                        self.condition.wait()
+                    else:
+                        self.condition.wait(self.delay - (time.time() - self.last_save))
+                if self.closed:
+                    return
+            try:
+                self.write_pending()
+            except Exception as e:
+                # The data we failed to write is queued again, so we retry after another delay. Meanwhile we keep the
+                # error for save() to raise, and flush() raises it too if it keeps failing.
+                with self.condition:
+                    self.error = e
+
+    def write_pending(self):
+        with self.write_lock:
+            with self.condition:
+                pending, self.pending = self.pending, {}
+            for i, data in pending.items():
+                try:
+                    self.editing_dataset[i] = data
+                except:
+                    with self.condition:
+                        for j, unwritten_data in pending.items():
+                            if j not in self.pending:
+                                self.pending[j] = unwritten_data
+                        self.last_save = time.time()
+                    raise
+
+            # Everything that failed before has been written now too, since it was queued again
+            with self.condition:
+                self.error = None
+
+    def flush(self):
+        # Save everything queued now, on this thread
+        self.write_pending()
+
+    def close(self):
+        # Stop our background thread, then flush. If flushing fails, the background thread is started again before
+        # the error is raised, so the data is still retried, and so is close() if it's called again.
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+        try:
+            self.flush()
+        except:
+            with self.condition:
+                self.start()
+            raise